@@ -1,20 +1,27 @@
+import telebot
+import requests
 from telebot import TeleBot
 from telebot import types, apihelper
-from telebot.handler_backends import State, StatesGroup
-from telebot.storage import StateMemoryStorage
 import sqlite3
+import queue
+import collections
+import threading
 import time
 import random
 import os
 import logging
+import html
 import re
 import sys
-import socket
 import atexit
 from dotenv import load_dotenv
 import signal
-import traceback
-import json
+import io
+import string
+import functools
+import weakref
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -35,18 +42,153 @@ class UserStates:
     WAITING_VOTES_COUNT = 'waiting_votes_count'
     WAITING_TOURNAMENT_TIME = 'waiting_tournament_time'
 
+# Количество рабочих потоков бота: медленный обработчик одного пользователя
+# не задерживает обновления остальных. Обработчики в основном ждут ответа
+# Telegram, поэтому под нагрузкой число потоков можно увеличить через окружение
+BOT_WORKER_THREADS = int(os.environ.get('BOT_WORKER_THREADS', 8))
+
 # Инициализация бота
-bot = telebot.TeleBot('8104692415:AAEFJiYdW85sXaAa4PFd-uOEcJZIBQfd31Q')
+class BotExceptionHandler(telebot.ExceptionHandler):
+    """Логирует исключения обработчиков из рабочих потоков и уведомляет администратора"""
+    def handle(self, exception):
+        # Сетевые ошибки и ошибки Telegram API (в том числе в потоке polling) оставляем
+        # telebot: он сам логирует их и повторяет запрос с паузой
+        if isinstance(exception, (requests.RequestException, apihelper.ApiException)):
+            return False
+        logger.error("Неперехваченная ошибка в обработчике: %s", exception, exc_info=exception)
+        send_message_async(ADMIN_ID, f"⚠️ Ошибка в обработчике бота:\n{html.escape(str(exception)[:200])}...")
+        return True
+
+bot = TeleBot('8104692415:AAEFJiYdW85sXaAa4PFd-uOEcJZIBQfd31Q', threaded=True, num_threads=BOT_WORKER_THREADS,
+              parse_mode="HTML", exception_handler=BotExceptionHandler())
+
+# Сессия пользователя: текущее состояние и данные незавершенного предложения
+class Session:
+    __slots__ = ('state', 'name', 'file_id', 'media_type', 'media_msg_id', 'preview_msg_id', 'votes_count', 'touched')
+    
+    def __init__(self, state=UserStates.START):
+        self.state = state
+        self.name = None
+        self.file_id = None
+        self.media_type = None
+        self.media_msg_id = None
+        self.preview_msg_id = None
+        self.votes_count = None
+        self.touched = time.monotonic()
+
+# Сессии пользователей по user_id
+sessions = {}
+_DEFAULT_SESSION = Session()
 
-# Словари для хранения данных пользователей
-user_states = {}
-user_data = {}
+# Сессия удаляется после SESSION_TTL секунд бездействия, проверка раз в SESSION_SWEEP_INTERVAL секунд
+SESSION_TTL = 1800
+SESSION_SWEEP_INTERVAL = 300
 
 # Константы
 ADMIN_ID = 1758948212  # Замените на ваш ID администратора
 
-# Список разрешенных пользователей (можно настроить в админ-панели)
-ALLOWED_USERS = [ADMIN_ID]  # По умолчанию только админ
+# Множество разрешенных пользователей (можно настроить в админ-панели)
+ALLOWED_USERS = {ADMIN_ID}  # По умолчанию только админ
+
+# Проверка подписки и списка разрешенных пользователей. Пока проверка подписки
+# не реализована, обработчики пропускают ее, не вызывая check_subscription
+SUBSCRIPTION_ENFORCED = False
+
+# Результаты проверки подписки: user_id -> (подписан, время истечения)
+_subscription_cache = {}
+SUBSCRIPTION_CACHE_TTL = 300
+
+# Допустимое имя участницы: буквы, цифры, пробелы и дефис.
+# \Z вместо $, чтобы не пропускать имя с завершающим переводом строки
+NAME_RE = re.compile(r"^[а-яА-ЯёЁa-zA-Z0-9\s-]+\Z", re.UNICODE)
+# Числовой ввод админа (голоса, часы): проверка до int() вместо перехвата ValueError
+INT_INPUT_RE = re.compile(r"\s*([0-9]{1,9})\s*\Z")
+
+# Файл базы данных
+DB_NAME = 'facemash.db'
+
+# PRAGMA-настройки, которые действуют в рамках одного соединения.
+# journal_mode=WAL сохраняется в самом файле БД, поэтому включается один раз в init_db
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA mmap_size=268435456",
+)
+
+# Размер пула соединений с базой данных
+DB_POOL_SIZE = 8
+
+# Размер кэша подготовленных выражений каждого соединения
+DB_CACHED_STATEMENTS = 256
+
+# Текущая версия схемы базы данных (хранится в PRAGMA user_version)
+SCHEMA_VERSION = 6
+
+# Первый байт file_ref - тип медиа, остальное - file_id Telegram
+MEDIA_PREFIXES = {'photo': b'\x01', 'video': b'\x02'}
+MEDIA_TYPES = {1: 'photo', 2: 'video'}
+
+def pack_file_ref(file_id, media_type):
+    """Упаковывает file_id и тип медиа в одно значение для базы данных"""
+    return MEDIA_PREFIXES[media_type] + file_id.encode()
+
+def unpack_file_ref(file_ref):
+    """Возвращает (file_id, media_type) из значения file_ref"""
+    if not file_ref:
+        return None, None
+    return file_ref[1:].decode(), MEDIA_TYPES[file_ref[0]]
+
+# Telegram принимает в одном альбоме от 2 до 10 медиа
+MEDIA_GROUP_LIMIT = 10
+
+def input_media(file_id, media_type, caption):
+    """Возвращает элемент альбома для send_media_group"""
+    # parse_mode бота на альбомы не распространяется
+    if media_type == 'photo':
+        return types.InputMediaPhoto(file_id, caption=caption, parse_mode="HTML")
+    return types.InputMediaVideo(file_id, caption=caption, parse_mode="HTML")
+
+# SQL-запросы горячих путей. Один и тот же объект строки при каждом вызове
+# позволяет sqlite3 брать уже подготовленное выражение из кэша соединения
+SQL_INSERT_SUGGESTION = """
+    INSERT INTO suggestions (name, file_ref, suggested_by, status)
+    VALUES (?, ?, ?, 'pending')
+"""
+SQL_SELECT_SUGGESTION = """
+    SELECT name, file_ref, suggested_by, status
+    FROM suggestions
+    WHERE id = ?
+"""
+SQL_UPDATE_SUGGESTION_STATUS = "UPDATE suggestions SET status = ? WHERE id = ?"
+SQL_INSERT_PHOTO = """
+    INSERT INTO photos (name, file_ref, approved)
+    VALUES (?, ?, 1)
+"""
+# Настройки меняются только у активного турнира: новый турнир создается со своими значениями
+SQL_UPDATE_TOURNAMENT_SETTINGS = """
+    UPDATE tournament_settings
+    SET required_votes = COALESCE(?, required_votes), tournament_duration = ?
+    WHERE is_active = 1
+"""
+# Массовое принятие ожидающих предложений, показанных администратору;
+# {ids} - плейсхолдеры по числу id
+SQL_ACCEPT_PENDING_PHOTOS = """
+    INSERT INTO photos (name, file_ref, approved)
+    SELECT name, file_ref, 1
+    FROM suggestions
+    WHERE status = 'pending' AND id IN ({ids})
+    ORDER BY id
+"""
+SQL_ACCEPT_PENDING_SUGGESTIONS = """
+    UPDATE suggestions SET status = 'accepted'
+    WHERE status = 'pending' AND id IN ({ids})
+    RETURNING name, suggested_by
+"""
+SQL_INSERT_VOTE = "INSERT OR IGNORE INTO user_votes (user_id, photo_id) VALUES (?, ?)"
+SQL_ADD_PHOTO_VOTE = "UPDATE photos SET votes = votes + 1 WHERE id = ? AND approved = 1 RETURNING votes, name"
 
 def create_admin_markup():
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -72,133 +214,654 @@ def create_user_markup():
     markup.row(btn_help)
     return markup
 
+def create_preview_markup():
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    edit_name_btn = types.InlineKeyboardButton("✏️ Изменить имя", callback_data="edit_name")
+    edit_media_btn = types.InlineKeyboardButton("🖼 Изменить медиа", callback_data="edit_media")
+    send_btn = types.InlineKeyboardButton("✅ Отправить", callback_data="send_proposal")
+    cancel_btn = types.InlineKeyboardButton("❌ Отмена", callback_data="cancel_proposal")
+    markup.add(edit_name_btn, edit_media_btn)
+    markup.add(send_btn, cancel_btn)
+    return markup
+
+def create_cancel_markup():
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    cancel_btn = types.KeyboardButton("❌ Отмена")
+    markup.add(cancel_btn)
+    return markup
+
+def create_subscription_markup():
+    markup = types.InlineKeyboardMarkup()
+    channel_btn = types.InlineKeyboardButton("Подписаться на канал", url="https://t.me/Simpatia_Liven57")
+    check_btn = types.InlineKeyboardButton("✅ Проверить подписку", callback_data="check_subscription")
+    markup.add(channel_btn)
+    markup.add(check_btn)
+    return markup
+
+def create_channel_markup():
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    channel_btn = types.InlineKeyboardButton("👉 Подписаться на канал", url="https://t.me/Simpatia_Liven57")
+    markup.add(channel_btn)
+    return markup
+
+def create_back_to_admin_markup():
+    markup = types.InlineKeyboardMarkup()
+    back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
+    markup.add(back_btn)
+    return markup
+
+def create_report_bug_markup():
+    markup = types.InlineKeyboardMarkup()
+    contact_button = types.InlineKeyboardButton("Написать разработчику", url="https://t.me/cloudysince")
+    markup.add(contact_button)
+    return markup
+
+def create_restart_confirm_markup():
+    markup = types.InlineKeyboardMarkup()
+    yes_btn = types.InlineKeyboardButton("✅ Да, перезапустить", callback_data="confirm_restart_yes")
+    no_btn = types.InlineKeyboardButton("❌ Нет, отмена", callback_data="admin_back_to_admin")
+    markup.row(yes_btn, no_btn)
+    return markup
+
+def create_tournament_settings_markup(is_active):
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    votes_btn = types.InlineKeyboardButton("🗳 Изменить кол-во голосов", callback_data="set_votes")
+    time_btn = types.InlineKeyboardButton("⏱ Изменить длительность", callback_data="set_time")
+    
+    if is_active:
+        status_btn = types.InlineKeyboardButton("🛑 Остановить турнир", callback_data="stop_tournament")
+    else:
+        status_btn = types.InlineKeyboardButton("▶️ Запустить турнир", callback_data="start_tournament")
+    
+    back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
+        
+    markup.add(votes_btn, time_btn)
+    markup.add(status_btn)
+    markup.add(back_btn)
+    return markup
+
+# Клавиатуры не меняются после создания, поэтому создаются один раз при запуске
+ADMIN_MARKUP = create_admin_markup()
+USER_MARKUP = create_user_markup()
+PREVIEW_MARKUP = create_preview_markup()
+CANCEL_MARKUP = create_cancel_markup()
+REMOVE_MARKUP = types.ReplyKeyboardRemove()
+SUBSCRIPTION_MARKUP = create_subscription_markup()
+CHANNEL_MARKUP = create_channel_markup()
+BACK_TO_ADMIN_MARKUP = create_back_to_admin_markup()
+REPORT_BUG_MARKUP = create_report_bug_markup()
+RESTART_CONFIRM_MARKUP = create_restart_confirm_markup()
+TOURNAMENT_SETTINGS_MARKUPS = {
+    True: create_tournament_settings_markup(True),
+    False: create_tournament_settings_markup(False),
+}
+
+# Шаблоны подписей превью и уведомления администратору
+PREVIEW_CAPTION_PHOTO = "📝 Предварительный просмотр:\n\n👤 Имя: {name}\n📎 Тип медиа: Фото"
+PREVIEW_CAPTION_VIDEO = "📝 Предварительный просмотр:\n\n👤 Имя: {name}\n📎 Тип медиа: Видео"
+ADMIN_SUGGESTION_CAPTION = "📝 Новое предложение!\n\n👤 Имя: {name}\n👤 От: {user_id}"
+
+# Постоянные тексты сообщений
+WELCOME_HTML = (
+    "👋 <b>Добро пожаловать в бот конкурса красоты!</b>\n\n"
+    "🔔 <b>Пожалуйста, подпишитесь на наш канал:</b>\n"
+    "@Simpatia_Liven57\n\n"
+    "Там вы найдете актуальную информацию о конкурсах и победителях."
+)
+START_MENU_HTML = (
+    "<b>Доступные команды:</b>\n"
+    "🎭 <b>Начать голосование</b> - участвовать в текущем турнире\n"
+    "🏆 <b>Топ участниц</b> - посмотреть рейтинг участниц\n"
+    "➕ <b>Предложить участницу</b> - предложить новую участницу"
+)
+SUBSCRIPTION_REQUIRED_TEXT = "⛔ Для использования бота необходимо подписаться на канал @Simpatia_Liven57"
+ADMIN_PANEL_TEMPLATE = (
+    "👑 <b>АДМИН-ПАНЕЛЬ</b>\n\n"
+    "📊 <b>Статистика:</b>\n"
+    "• Участниц: {participants_count}\n"
+    "• Ожидают проверки: {pending_count}\n"
+    "• Статус турнира: {tournament_status}\n\n"
+    "Выберите действие:"
+)
+
 # Вспомогательные функции
 def get_user_state(user_id):
-    return user_states.get(user_id, UserStates.START)
+    return sessions.get(user_id, _DEFAULT_SESSION).state
+
+def get_session(user_id):
+    """Возвращает сессию пользователя, создавая ее при необходимости"""
+    sess = sessions.get(user_id)
+    if sess is None:
+        sess = sessions[user_id] = Session()
+    sess.touched = time.monotonic()
+    return sess
 
 def set_user_state(user_id, state):
-    user_states[user_id] = state
+    get_session(user_id).state = state
 
-def init_db():
-    conn = sqlite3.connect('facemash.db')
-    c = conn.cursor()
-    
-    # Создаем таблицу для предложений
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS suggestions
-        (id INTEGER PRIMARY KEY AUTOINCREMENT,
-         name TEXT NOT NULL,
-         file_id TEXT NOT NULL,
-         media_type TEXT NOT NULL,
-         suggested_by INTEGER NOT NULL,
-         status TEXT DEFAULT 'pending',
-         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
-    ''')
-    
-    # Создаем таблицу для фотографий
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS photos
-        (id INTEGER PRIMARY KEY AUTOINCREMENT,
-         name TEXT NOT NULL,
-         file_id TEXT NOT NULL,
-         approved INTEGER DEFAULT 0,
-         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
-    ''')
+def reset_session(user_id):
+    """Сбрасывает состояние пользователя и данные предложения"""
+    sessions.pop(user_id, None)
+
+# Блокировки пользователей: обновления одного пользователя обрабатываются по порядку,
+# обновления разных пользователей - параллельно в пуле потоков бота.
+# Блокировка живет, пока ее удерживает или ждет хотя бы один обработчик
+_user_locks = weakref.WeakValueDictionary()
+_user_locks_guard = threading.Lock()
+
+def user_lock(user_id):
+    """Возвращает блокировку, упорядочивающую обработку обновлений пользователя"""
+    with _user_locks_guard:
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = threading.RLock()
+        return lock
+
+def serialized_per_user(handler):
+    """Декоратор: обновления одного пользователя обрабатываются строго по очереди"""
+    @functools.wraps(handler)
+    def wrapper(update):
+        with user_lock(update.from_user.id):
+            return handler(update)
+    return wrapper
+
+def require_subscription(handler):
+    """Декоратор: пропускает обновление к обработчику только при подписке на канал"""
+    @functools.wraps(handler)
+    def wrapper(update):
+        if SUBSCRIPTION_ENFORCED and not is_subscribed(update):
+            if isinstance(update, types.CallbackQuery):
+                bot.answer_callback_query(update.id, "⛔ Для использования бота необходимо подписаться на канал!", show_alert=True)
+                send_subscription_message(update.message.chat.id)
+            else:
+                bot.reply_to(update, SUBSCRIPTION_REQUIRED_TEXT, reply_markup=SUBSCRIPTION_MARKUP)
+            return
+        return handler(update)
+    return wrapper
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity про запас"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'lock')
     
-    # Проверяем наличие столбца media_type в таблице photos
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        
+    def acquire(self, count=1):
+        """Ждет, пока наберется count токенов, и забирает их"""
+        count = min(count, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                wait = (count - self.tokens) / self.rate
+            time.sleep(wait)
+            
+    def idle(self, now):
+        """True, если корзина давно не использовалась и уже полностью восполнилась"""
+        return (now - self.updated) * self.rate >= self.capacity
+
+# Лимиты Telegram: не больше 30 сообщений в секунду всего, около одного в секунду в личный
+# чат (короткие всплески допустимы) и 20 в минуту в одну группу
+_GLOBAL_SEND_BUCKET = TokenBucket(30, 30)
+_chat_send_buckets = {}
+_chat_send_buckets_guard = threading.Lock()
+
+def throttle_send(chat_id, count=1):
+    """Дожидается разрешения лимитов на отправку count сообщений в чат"""
+    with _chat_send_buckets_guard:
+        bucket = _chat_send_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(20 / 60, 20) if chat_id < 0 else TokenBucket(1, 20)
+            _chat_send_buckets[chat_id] = bucket
+    bucket.acquire(count)
+    _GLOBAL_SEND_BUCKET.acquire(count)
+
+# Сколько раз повторяем отправку, если Telegram ответил 429 Too Many Requests
+SEND_RETRY_ATTEMPTS = 3
+
+def send_with_retry(send, *args, **kwargs):
+    """Вызывает метод отправки бота, выжидая retry_after при ответе 429"""
+    for attempt in range(SEND_RETRY_ATTEMPTS):
+        try:
+            return send(*args, **kwargs)
+        except apihelper.ApiTelegramException as e:
+            if e.error_code != 429 or attempt == SEND_RETRY_ATTEMPTS - 1:
+                raise
+            retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+            logger.warning("Превышен лимит Telegram, повтор через %s с", retry_after)
+            time.sleep(retry_after)
+
+# Второстепенная работа (удаление служебных сообщений, проверка завершения турнира)
+# выполняется в фоне, чтобы не задерживать обработчик
+_BACKGROUND_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="background")
+
+# Пул для параллельной отправки независимых сообщений Telegram
+_SEND_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="send")
+
+# Длинные списки и экспорт админ-панели отправляются отдельно, чтобы не занимать рабочие потоки бота
+_LISTING_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="listing")
+
+# Сколько медиа одного списка отправляется одновременно через _SEND_EXECUTOR;
+# остальные потоки пула остаются свободными для других отправок, темп задает throttle_send
+LISTING_SEND_WORKERS = 8
+
+def _send_media_item(chat_id, item):
+    file_id, media_type, caption, markup = item
+    try:
+        throttle_send(chat_id)
+        if media_type == 'photo':
+            send_with_retry(bot.send_photo, chat_id, file_id, caption=caption, reply_markup=markup)
+        else:
+            send_with_retry(bot.send_video, chat_id, file_id, caption=caption, reply_markup=markup)
+        return True
+    except telebot.apihelper.ApiException as api_err:
+        logger.error("Ошибка API при отправке медиа %s: %s", file_id, api_err)
+        return False
+
+def send_media_items_each(chat_id, items):
+    """Отправляет (file_id, media_type, caption, markup) параллельно, возвращает флаги отправки"""
+    if len(items) <= 1:
+        return [_send_media_item(chat_id, item) for item in items]
+    sent = []
+    for i in range(0, len(items), LISTING_SEND_WORKERS):
+        sent.extend(_SEND_EXECUTOR.map(lambda item: _send_media_item(chat_id, item), items[i:i + LISTING_SEND_WORKERS]))
+    return sent
+
+def send_media_items(chat_id, items):
+    """Отправляет (file_id, media_type, caption, markup) параллельно, возвращает число отправленных"""
+    return sum(send_media_items_each(chat_id, items))
+
+def _send_message(chat_id, text):
     try:
-        c.execute("SELECT media_type FROM photos LIMIT 1")
-    except sqlite3.OperationalError:
-        # Столбец не существует, добавляем его
-        logger.info("Добавление столбца media_type в таблицу photos")
-        c.execute("ALTER TABLE photos ADD COLUMN media_type TEXT DEFAULT 'photo'")
-        logger.info("Столбец media_type добавлен успешно")
+        throttle_send(chat_id)
+        send_with_retry(bot.send_message, chat_id, text)
+    except Exception as e:
+        logger.error("Не удалось отправить сообщение в чат %s: %s", chat_id, e)
+
+def send_message_async(chat_id, text):
+    """Отправляет сообщение в фоне, не дожидаясь ответа Telegram"""
+    _SEND_EXECUTOR.submit(_send_message, chat_id, text)
+
+def _delete_message(chat_id, message_id):
+    try:
+        bot.delete_message(chat_id, message_id)
+    except Exception as e:
+        logger.warning("Не удалось удалить сообщение %s: %s", message_id, e)
+
+def safe_delete_message(chat_id, message_id):
+    """Удаляет сообщение в фоне, ошибки только логируются"""
+    _BACKGROUND_EXECUTOR.submit(_delete_message, chat_id, message_id)
+
+def _sweep_sessions():
+    """Удаляет заброшенные сессии и устаревшие кэши пользователей, планирует следующую проверку"""
+    now = time.monotonic()
+    for user_id, sess in list(sessions.items()):
+        if now - sess.touched > SESSION_TTL:
+            sessions.pop(user_id, None)
+    for user_id, (_, expires) in list(_subscription_cache.items()):
+        if expires <= now:
+            _subscription_cache.pop(user_id, None)
+    for user_id, (_, touched) in list(_voted_cache.items()):
+        if now - touched > SESSION_TTL:
+            _voted_cache.pop(user_id, None)
+    with _chat_send_buckets_guard:
+        for chat_id, bucket in list(_chat_send_buckets.items()):
+            if bucket.idle(now):
+                del _chat_send_buckets[chat_id]
+    schedule_session_sweep()
+
+def schedule_session_sweep():
+    """Запускает отложенную очистку сессий в фоновом потоке"""
+    timer = threading.Timer(SESSION_SWEEP_INTERVAL, _sweep_sessions)
+    timer.daemon = True
+    timer.start()
+
+def _open_conn():
+    """Открывает соединение с базой данных и применяет PRAGMA-настройки"""
+    # isolation_level="IMMEDIATE": неявные транзакции сразу берут блокировку на запись,
+    # а не повышают ее посреди транзакции (что приводит к SQLITE_BUSY)
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, isolation_level="IMMEDIATE",
+                           cached_statements=DB_CACHED_STATEMENTS)
+    # Строки доступны и по индексу/распаковкой, и по имени столбца
+    conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+# Пул долгоживущих соединений: страницы кэша SQLite не теряются между обработчиками
+_POOL = queue.Queue(maxsize=DB_POOL_SIZE)
+
+def fill_db_pool():
+    """Заранее открывает соединения для пула"""
+    while not _POOL.full():
+        _POOL.put_nowait(_open_conn())
+
+@contextmanager
+def get_conn():
+    """Выдает соединение из пула и возвращает его обратно после использования
     
-    # Проверяем наличие столбца votes в таблице photos
+    Если пул пуст, открывается новое соединение; лишние соединения закрываются.
+    """
+    try:
+        conn = _POOL.get_nowait()
+    except queue.Empty:
+        conn = _open_conn()
     try:
-        c.execute("SELECT votes FROM photos LIMIT 1")
-    except sqlite3.OperationalError:
-        # Столбец не существует, добавляем его
-        logger.info("Добавление столбца votes в таблицу photos")
-        c.execute("ALTER TABLE photos ADD COLUMN votes INTEGER DEFAULT 0")
-        logger.info("Столбец votes добавлен успешно")
+        yield conn
+    finally:
+        # Незавершенная транзакция не должна достаться следующему обработчику
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _POOL.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+@contextmanager
+def write_transaction(conn):
+    """Выполняет блок в транзакции BEGIN IMMEDIATE
     
-    # Создаем таблицу для голосов
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS user_votes
-        (user_id INTEGER NOT NULL,
-         photo_id INTEGER NOT NULL,
-         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-         PRIMARY KEY (user_id, photo_id))
-    ''')
+    Фиксирует изменения при успешном выходе и откатывает их при исключении.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+# Активный турнир меняется только при запуске/остановке, поэтому хранится в памяти
+# и сбрасывается при каждом изменении турнира
+_active_tournament_cache = {'id': None, 'required_votes': None, 'valid': False}
+_active_tournament_lock = threading.Lock()
+
+def get_active_tournament():
+    """Возвращает (id, required_votes) активного турнира или None"""
+    with _active_tournament_lock:
+        if not _active_tournament_cache['valid']:
+            with get_conn() as conn:
+                row = conn.execute(
+                    "SELECT id, required_votes FROM tournament_settings WHERE is_active = 1"
+                ).fetchone()
+            _active_tournament_cache['id'], _active_tournament_cache['required_votes'] = row or (None, None)
+            _active_tournament_cache['valid'] = True
+        if _active_tournament_cache['id'] is None:
+            return None
+        return _active_tournament_cache['id'], _active_tournament_cache['required_votes']
+
+# Настройки для страницы админ-панели: активного турнира, а если его нет - последнего
+_tournament_settings_cache = {'settings': None, 'valid': False}
+
+def get_tournament_settings():
+    """Возвращает (required_votes, tournament_duration, is_active) или None"""
+    with _active_tournament_lock:
+        if not _tournament_settings_cache['valid']:
+            with get_conn() as conn:
+                _tournament_settings_cache['settings'] = conn.execute("""
+                    SELECT required_votes, tournament_duration, is_active
+                    FROM tournament_settings
+                    ORDER BY is_active DESC, id DESC
+                    LIMIT 1
+                """).fetchone()
+            _tournament_settings_cache['valid'] = True
+        return _tournament_settings_cache['settings']
+
+def invalidate_tournament_cache():
+    """Сбрасывает закэшированный активный турнир и настройки турнира"""
+    with _active_tournament_lock:
+        _active_tournament_cache['valid'] = False
+        _tournament_settings_cache['valid'] = False
+
+# Список одобренных участниц меняется только при принятии предложения или удалении,
+# поэтому хранится в памяти и используется для выбора пары для голосования
+_approved_ids_cache = {'ids': None}
+_approved_ids_lock = threading.Lock()
+
+def get_approved_ids():
+    """Возвращает кортеж id одобренных участниц"""
+    with _approved_ids_lock:
+        if _approved_ids_cache['ids'] is None:
+            with get_conn() as conn:
+                rows = conn.execute("SELECT id FROM photos WHERE approved = 1").fetchall()
+            _approved_ids_cache['ids'] = tuple(row[0] for row in rows)
+        return _approved_ids_cache['ids']
+
+def invalidate_approved_ids():
+    """Сбрасывает закэшированный список одобренных участниц"""
+    with _approved_ids_lock:
+        _approved_ids_cache['ids'] = None
+
+# Статистика админ-панели: пересчитывается не чаще раза в STATS_CACHE_TTL секунд.
+# При предложениях, решениях по ним и удалении участниц сбрасываются только
+# затронутые ключи; изменения от голосов подхватываются по истечении TTL.
+# Ключ -> (значение, момент устаревания)
+STATS_CACHE_TTL = 30
+_stats_cache = {}
+_stats_lock = threading.Lock()
+
+def _cached_stat(key, load):
+    with _stats_lock:
+        value, expires = _stats_cache.get(key, (None, 0.0))
+        now = time.monotonic()
+        if value is None or expires <= now:
+            value = load()
+            _stats_cache[key] = (value, now + STATS_CACHE_TTL)
+        return value
+
+def _load_counts():
+    with get_conn() as conn:
+        return tuple(conn.execute("""
+            SELECT (SELECT COUNT(*) FROM photos WHERE approved = 1),
+                   (SELECT COUNT(*) FROM suggestions WHERE status = 'pending'),
+                   (SELECT COUNT(*) FROM user_votes),
+                   (SELECT COUNT(DISTINCT user_id) FROM user_votes)
+        """).fetchone())
+
+def _load_ranking():
+    with get_conn() as conn:
+        return conn.execute("""
+            SELECT id, name, file_ref, votes
+            FROM photos
+            WHERE approved = 1
+            ORDER BY votes DESC
+        """).fetchall()
+
+def _load_photos_count():
+    with get_conn() as conn:
+        return conn.execute("SELECT COUNT(*) FROM photos").fetchone()[0]
+
+def get_photos_count():
+    """Возвращает число участниц; голоса на него не влияют и кэш не сбрасывают"""
+    return _cached_stat('photos_count', _load_photos_count)
+
+def get_ranked_participants():
+    """Возвращает одобренных участниц (id, name, file_ref, votes) по убыванию голосов"""
+    return _cached_stat('ranking', _load_ranking)
+
+def get_statistics():
+    """Возвращает (участниц, ожидающих предложений, голосов, голосующих, топ-3)"""
+    top_participants = [(row['name'], row['votes']) for row in get_ranked_participants()[:3]]
+    return (*_cached_stat('counts', _load_counts), top_participants)
+
+# Ключи кэша, которые меняются при добавлении или удалении участниц
+STATS_PARTICIPANT_KEYS = ('counts', 'ranking', 'photos_count')
+
+def invalidate_statistics(*keys):
+    """Сбрасывает указанные ключи кэша статистики, без ключей - весь кэш"""
+    with _stats_lock:
+        if not keys:
+            _stats_cache.clear()
+        for key in keys:
+            _stats_cache.pop(key, None)
+
+# Участницы, за которых пользователь уже голосовал: user_id -> [множество id, время обращения].
+# Заполняется из базы при первом обращении и дополняется в handle_vote
+_voted_cache = {}
+
+def get_voted_ids(user_id, conn):
+    """Возвращает множество id участниц, за которых голосовал пользователь"""
+    entry = _voted_cache.get(user_id)
+    if entry is None:
+        voted = {row[0] for row in conn.execute(
+            "SELECT photo_id FROM user_votes WHERE user_id = ?", (user_id,)
+        )}
+        entry = _voted_cache[user_id] = [voted, 0]
+    entry[1] = time.monotonic()
+    return entry[0]
+
+def remember_vote(user_id, photo_id):
+    """Добавляет голос в кэш, если он уже загружен для пользователя"""
+    entry = _voted_cache.get(user_id)
+    if entry is not None:
+        entry[0].add(photo_id)
+
+def init_db():
+    conn = _open_conn()
+    c = conn.cursor()
     
-    # Создаем таблицу для настроек турнира
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS tournament_settings
-        (id INTEGER PRIMARY KEY AUTOINCREMENT,
-         required_votes INTEGER NOT NULL,
-         tournament_duration INTEGER NOT NULL,
-         is_active INTEGER DEFAULT 0,
-         current_tournament_start TIMESTAMP,
-         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
-    ''')
+    # Включаем WAL: запись не блокирует читателей и требует меньше fsync
+    journal_mode = c.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    if journal_mode != 'wal':
+        # Например, на файловых системах без поддержки разделяемой памяти
+        logger.warning("Не удалось включить WAL, режим журнала: %s", journal_mode)
     
-    # Обновляем количество голосов до 15 для всех активных турниров
-    try:
-        # Проверяем, есть ли активные турниры с required_votes = 100
-        c.execute("SELECT id FROM tournament_settings WHERE is_active = 1 AND required_votes = 100")
-        if c.fetchone():
-            logger.info("Обновление количества голосов до 15 для активных турниров")
-            c.execute("UPDATE tournament_settings SET required_votes = 15 WHERE is_active = 1 AND required_votes = 100")
-            logger.info(f"Обновлено записей: {c.rowcount}")
-    except Exception as e:
-        logger.error(f"Ошибка при обновлении количества голосов: {e}")
+    # Миграции выполняются только если схема базы старее текущей
+    version = c.execute("PRAGMA user_version").fetchone()[0]
+    if version < SCHEMA_VERSION:
+        logger.info("Обновление схемы базы данных с версии %s до %s", version, SCHEMA_VERSION)
+        with write_transaction(conn):
+            _migrate(c, version)
+            c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     
-    conn.commit()
+    # Обновляем статистику планировщика запросов
+    c.execute("PRAGMA optimize")
     conn.close()
     
     logger.info("База данных инициализирована")
 
+def _migrate(c, version):
+    """Последовательно применяет миграции схемы, начиная с версии version
+    
+    Шаги написаны так, чтобы их можно было повторить на базах, созданных
+    до появления user_version (у них версия 0).
+    """
+    if version < 1:
+        # Создаем таблицу для предложений
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS suggestions
+            (id INTEGER PRIMARY KEY AUTOINCREMENT,
+             name TEXT NOT NULL,
+             file_id TEXT NOT NULL,
+             media_type TEXT NOT NULL,
+             suggested_by INTEGER NOT NULL,
+             status TEXT DEFAULT 'pending',
+             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+        ''')
+        
+        # Создаем таблицу для фотографий
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS photos
+            (id INTEGER PRIMARY KEY AUTOINCREMENT,
+             name TEXT NOT NULL,
+             file_id TEXT NOT NULL,
+             approved INTEGER DEFAULT 0,
+             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+        ''')
+        
+        # Создаем таблицу для голосов
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS user_votes
+            (user_id INTEGER NOT NULL,
+             photo_id INTEGER NOT NULL,
+             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+             PRIMARY KEY (user_id, photo_id))
+        ''')
+        
+        # Создаем таблицу для настроек турнира
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS tournament_settings
+            (id INTEGER PRIMARY KEY AUTOINCREMENT,
+             required_votes INTEGER NOT NULL,
+             tournament_duration INTEGER NOT NULL,
+             is_active INTEGER DEFAULT 0,
+             current_tournament_start TIMESTAMP,
+             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+        ''')
+    
+    # Получаем список столбцов таблицы photos одним запросом
+    photo_columns = {row[1] for row in c.execute("PRAGMA table_info(photos)")}
+    
+    if version < 2:
+        # Добавляем столбец media_type в таблицу photos
+        if 'media_type' not in photo_columns:
+            logger.info("Добавление столбца media_type в таблицу photos")
+            c.execute("ALTER TABLE photos ADD COLUMN media_type TEXT DEFAULT 'photo'")
+            logger.info("Столбец media_type добавлен успешно")
+    
+    if version < 3:
+        # Добавляем столбец votes в таблицу photos
+        if 'votes' not in photo_columns:
+            logger.info("Добавление столбца votes в таблицу photos")
+            c.execute("ALTER TABLE photos ADD COLUMN votes INTEGER DEFAULT 0")
+            logger.info("Столбец votes добавлен успешно")
+        
+        # Обновляем количество голосов до 15 для всех активных турниров
+        c.execute("UPDATE tournament_settings SET required_votes = 15 WHERE is_active = 1 AND required_votes = 100")
+        if c.rowcount:
+            logger.info("Обновлено количество голосов до 15 для активных турниров: %s", c.rowcount)
+    
+    if version < 4:
+        # Индексы для частых выборок: ожидающие предложения, рейтинг одобренных участниц
+        # (покрывает ORDER BY votes DESC без сортировки таблицы) и голоса по участнице
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sugg_status ON suggestions(status)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_photos_approved ON photos(approved, votes DESC)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_votes_photo ON user_votes(photo_id)")
+    
+    if version < 5:
+        # Объединяем file_id и media_type в один столбец file_ref
+        for table in ('suggestions', 'photos'):
+            c.execute(f"ALTER TABLE {table} ADD COLUMN file_ref BLOB")
+            c.execute(f"""
+                UPDATE {table}
+                SET file_ref = CAST((CASE media_type WHEN 'video' THEN char(2) ELSE char(1) END) || file_id AS BLOB)
+            """)
+            c.execute(f"ALTER TABLE {table} DROP COLUMN file_id")
+            c.execute(f"ALTER TABLE {table} DROP COLUMN media_type")
+    
+    if version < 6:
+        # Ожидающие предложения выдаются сразу в порядке created_at, без временной сортировки
+        c.execute("DROP INDEX IF EXISTS idx_sugg_status")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sugg_status_created ON suggestions(status, created_at)")
+
 @bot.message_handler(commands=['propose'])
+@require_subscription
+@serialized_per_user
 def start_proposal(message):
     try:
-        logger.info(f"Пользователь {message.from_user.id} начал предложение участницы")
+        logger.info("Пользователь %s начал предложение участницы", message.from_user.id)
         
         user_id = message.from_user.id
         
-        # Проверяем подписку на канал
-        if not check_subscription(user_id):
-            markup = types.InlineKeyboardMarkup()
-            channel_btn = types.InlineKeyboardButton("Подписаться на канал", url="https://t.me/Simpatia_Liven57")
-            check_btn = types.InlineKeyboardButton("✅ Проверить подписку", callback_data="check_subscription")
-            markup.add(channel_btn)
-            markup.add(check_btn)
-            
-            bot.reply_to(
-                message,
-                "⛔ Для использования бота необходимо подписаться на канал @Simpatia_Liven57",
-                reply_markup=markup
-            )
-            return
-            
-        # Проверяем доступ пользователя
-        if user_id not in ALLOWED_USERS:
-            bot.reply_to(message, "⛔ У вас нет доступа к боту. Обратитесь к администратору.")
-            return
-        
         # Проверяем, не находится ли пользователь уже в процессе предложения
         if get_user_state(user_id) != UserStates.START:
             bot.reply_to(message, "У вас уже есть активный процесс предложения. Пожалуйста, завершите его или отмените командой /cancel")
             return
             
         # Устанавливаем состояние ожидания имени
-        set_user_state(user_id, UserStates.WAITING_NAME)
-        user_data[user_id] = {}
+        sessions[user_id] = Session(UserStates.WAITING_NAME)
         
         # Создаем клавиатуру с кнопкой отмены
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        cancel_btn = types.KeyboardButton("❌ Отмена")
-        markup.add(cancel_btn)
+        markup = CANCEL_MARKUP
         
         bot.reply_to(
             message,
@@ -207,23 +870,16 @@ def start_proposal(message):
         )
         
     except Exception as e:
-        logger.error(f"Ошибка в start_proposal: {e}")
+        logger.error("Ошибка в start_proposal: %s", e)
         bot.reply_to(message, "Произошла ошибка при начале предложения")
         
-@bot.message_handler(func=lambda message: get_user_state(message.from_user.id) == UserStates.WAITING_NAME)
+@bot.message_handler(func=lambda message: getattr(message, 'user_state', None) == UserStates.WAITING_NAME)
+@require_subscription
+@serialized_per_user
 def handle_name(message):
     try:
         user_id = message.from_user.id
         
-        # Проверяем подписку на канал перед любым действием
-        if not check_subscription(user_id):
-            send_subscription_message(message.chat.id)
-            return
-            
-        # Если пользователь подписан, добавляем его в список разрешенных
-        if user_id not in ALLOWED_USERS:
-            ALLOWED_USERS.append(user_id)
-            
         name = message.text.strip()
         
         # Проверяем отмену
@@ -237,17 +893,16 @@ def handle_name(message):
             return
             
         # Проверяем на запрещенные символы (исправленное регулярное выражение)
-        if not re.match(r"^[а-яА-ЯёЁa-zA-Z0-9\s-]+$", name, re.UNICODE):
+        if not NAME_RE.match(name):
             bot.reply_to(message, "Имя может содержать только буквы, цифры, пробелы и дефис. Попробуйте еще раз:")
             return
             
         # Сохраняем имя и переходим к ожиданию медиа
-        user_data[user_id]['name'] = name
-        set_user_state(user_id, UserStates.WAITING_MEDIA)
+        sess = get_session(user_id)
+        sess.name = name
+        sess.state = UserStates.WAITING_MEDIA
         
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        cancel_btn = types.KeyboardButton("❌ Отмена")
-        markup.add(cancel_btn)
+        markup = CANCEL_MARKUP
         
         bot.reply_to(
             message,
@@ -256,82 +911,62 @@ def handle_name(message):
         )
         
     except Exception as e:
-        logger.error(f"Ошибка в handle_name: {e}")
+        logger.error("Ошибка в handle_name: %s", e)
         bot.reply_to(message, "Произошла ошибка при обработке имени")
         
-@bot.message_handler(content_types=['photo', 'video'], func=lambda message: get_user_state(message.from_user.id) == UserStates.WAITING_MEDIA)
+@bot.message_handler(content_types=['photo', 'video'], func=lambda message: getattr(message, 'user_state', None) == UserStates.WAITING_MEDIA)
+@require_subscription
+@serialized_per_user
 def handle_media(message):
     try:
         user_id = message.from_user.id
-        logging.info(f"Обработка медиа от пользователя {user_id}")
-        
-        # Проверяем подписку на канал перед любым действием
-        if not check_subscription(user_id):
-            send_subscription_message(message.chat.id)
-            return
-            
-        # Если пользователь подписан, добавляем его в список разрешенных
-        if user_id not in ALLOWED_USERS:
-            ALLOWED_USERS.append(user_id)
+        logger.info("Обработка медиа от пользователя %s", user_id)
         
-        # Проверяем, существуют ли данные пользователя
-        if user_id not in user_data:
-            logging.warning(f"Данные пользователя {user_id} отсутствуют")
-            user_data[user_id] = {}
+        sess = get_session(user_id)
             
         # Проверяем наличие имени
-        if 'name' not in user_data[user_id]:
-            logging.warning(f"Отсутствует имя в данных пользователя {user_id}")
+        if sess.name is None:
+            logger.warning("Отсутствует имя в данных пользователя %s", user_id)
             bot.send_message(message.chat.id, "Произошла ошибка: данные о имени отсутствуют. Пожалуйста, начните заново с команды /propose")
-            set_user_state(user_id, UserStates.START)
+            reset_session(user_id)
             return
         
         # Получаем file_id и тип медиа
-        if message.content_type == 'photo':
-            if not message.photo or len(message.photo) == 0:
-                logger.warning(f"Получено пустое фото от пользователя {user_id}")
+        media_type = message.content_type
+        if media_type == 'photo':
+            photos = message.photo
+            if not photos:
+                logger.warning("Получено пустое фото от пользователя %s", user_id)
                 bot.reply_to(message, "Не удалось получить фото. Пожалуйста, попробуйте еще раз.")
                 return
                 
-            file_id = message.photo[-1].file_id
-            media_type = 'photo'
-            logger.info(f"Получено фото от пользователя {user_id}, file_id: {file_id}")
+            # Telegram присылает размеры по возрастанию, берем самый большой
+            file_id = photos[-1].file_id
+            logger.info("Получено фото от пользователя %s, file_id: %s", user_id, file_id)
         else:  # video
-            if not hasattr(message, 'video') or not message.video:
-                logger.warning(f"Получено пустое видео от пользователя {user_id}")
+            if not message.video:
+                logger.warning("Получено пустое видео от пользователя %s", user_id)
                 bot.reply_to(message, "Не удалось получить видео. Пожалуйста, попробуйте еще раз.")
                 return
                 
             file_id = message.video.file_id
-            media_type = 'video'
-            logger.info(f"Получено видео от пользователя {user_id}, file_id: {file_id}")
+            logger.info("Получено видео от пользователя %s, file_id: %s", user_id, file_id)
             
         # Сохраняем информацию о медиа
-        user_data[user_id]['file_id'] = file_id
-        user_data[user_id]['media_type'] = media_type
+        sess.file_id = file_id
+        sess.media_type = media_type
+        sess.media_msg_id = message.message_id
         
         # Создаем превью предложения
-        name = user_data[user_id]['name']
-        
-        # Создаем клавиатуру для превью
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        edit_name_btn = types.InlineKeyboardButton("✏️ Изменить имя", callback_data="edit_name")
-        edit_media_btn = types.InlineKeyboardButton("🖼 Изменить медиа", callback_data="edit_media")
-        send_btn = types.InlineKeyboardButton("✅ Отправить", callback_data="send_proposal")
-        cancel_btn = types.InlineKeyboardButton("❌ Отмена", callback_data="cancel_proposal")
-        
-        markup.add(edit_name_btn, edit_media_btn)
-        markup.add(send_btn, cancel_btn)
+        name = sess.name
         
-        caption = f"📝 Предварительный просмотр:\n\n👤 Имя: {name}\n📎 Тип медиа: {'Фото' if media_type == 'photo' else 'Видео'}"
+        markup = PREVIEW_MARKUP
+        caption = (PREVIEW_CAPTION_PHOTO if media_type == 'photo' else PREVIEW_CAPTION_VIDEO).format(name=name)
         
         try:
             # Удаляем предыдущее превью, если оно было
-            if 'preview_message_id' in user_data[user_id]:
-                try:
-                    bot.delete_message(message.chat.id, user_data[user_id]['preview_message_id'])
-                except Exception as del_err:
-                    logger.warning(f"Не удалось удалить предыдущее превью: {del_err}")
+            if sess.preview_msg_id is not None:
+                safe_delete_message(message.chat.id, sess.preview_msg_id)
             
             # Отправляем новое превью
             sent_msg = None
@@ -339,70 +974,61 @@ def handle_media(message):
                 try:
                     sent_msg = bot.send_photo(message.chat.id, file_id, caption=caption, reply_markup=markup)
                 except telebot.apihelper.ApiException as api_err:
-                    logger.error(f"Ошибка API при отправке фото: {api_err}")
+                    logger.error("Ошибка API при отправке фото: %s", api_err)
                     bot.reply_to(message, "Не удалось отправить фото. Возможно, формат не поддерживается.")
                     return
             else:
                 try:
                     sent_msg = bot.send_video(message.chat.id, file_id, caption=caption, reply_markup=markup)
                 except telebot.apihelper.ApiException as api_err:
-                    logger.error(f"Ошибка API при отправке видео: {api_err}")
+                    logger.error("Ошибка API при отправке видео: %s", api_err)
                     bot.reply_to(message, "Не удалось отправить видео. Возможно, формат не поддерживается или размер слишком большой.")
                     return
                 
             if sent_msg:
                 # Сохраняем ID сообщения с превью для возможности его обновления
-                user_data[user_id]['preview_message_id'] = sent_msg.message_id
+                sess.preview_msg_id = sent_msg.message_id
             else:
-                logger.error(f"Не удалось отправить превью - sent_msg is None")
+                logger.error("Не удалось отправить превью - sent_msg is None")
                 bot.reply_to(message, "Не удалось создать превью. Пожалуйста, попробуйте еще раз.")
                 return
             
         except telebot.apihelper.ApiException as api_err:
-            logger.error(f"Ошибка API при отправке превью: {api_err}")
+            logger.error("Ошибка API при отправке превью: %s", api_err)
             bot.reply_to(message, "Не удалось отправить превью. Проверьте формат медиа и попробуйте еще раз.")
             return
         except Exception as gen_err:
-            logger.error(f"Неизвестная ошибка при отправке превью: {gen_err}")
+            logger.error("Неизвестная ошибка при отправке превью: %s", gen_err)
             bot.reply_to(message, "Произошла ошибка при создании превью. Пожалуйста, попробуйте еще раз.")
             return
             
         # Убираем клавиатуру с кнопкой отмены
-        markup = types.ReplyKeyboardRemove()
+        markup = REMOVE_MARKUP
         bot.send_message(message.chat.id, "👆 Проверьте правильность данных", reply_markup=markup)
         
         # Обновляем состояние
-        set_user_state(user_id, UserStates.PREVIEW_SUBMISSION)
+        sess.state = UserStates.PREVIEW_SUBMISSION
         
     except Exception as e:
-        logger.error(f"Ошибка в handle_media: {e}")
+        logger.error("Ошибка в handle_media: %s", e)
         bot.reply_to(message, "Произошла ошибка при обработке медиа. Пожалуйста, попробуйте еще раз или обратитесь к администратору.")
         # Сбрасываем состояние пользователя и очищаем данные
         try:
-            set_user_state(message.from_user.id, UserStates.START)
-            user_data.pop(message.from_user.id, None)
+            reset_session(message.from_user.id)
         except:
             pass
 
-@bot.callback_query_handler(func=lambda call: call.data in ["edit_name", "edit_media", "send_proposal", "cancel_proposal"])
+@require_subscription
+@serialized_per_user
 def handle_preview_buttons(call):
     try:
         user_id = call.from_user.id
-        logging.info(f"Обработка нажатия кнопки {call.data} от пользователя {user_id}")
-        
-        # Проверяем подписку на канал перед любым действием
-        if not check_subscription(user_id):
-            bot.answer_callback_query(call.id, "⛔ Для использования бота необходимо подписаться на канал!")
-            send_subscription_message(call.message.chat.id)
-            return
-            
-        # Если пользователь подписан, добавляем его в список разрешенных
-        if user_id not in ALLOWED_USERS:
-            ALLOWED_USERS.append(user_id)
+        logger.info("Обработка нажатия кнопки %s от пользователя %s", call.data, user_id)
         
         # Проверяем наличие данных пользователя
-        if user_id not in user_data:
-            logging.warning(f"Данные пользователя {user_id} отсутствуют при нажатии кнопки {call.data}")
+        sess = sessions.get(user_id)
+        if sess is None:
+            logger.warning("Данные пользователя %s отсутствуют при нажатии кнопки %s", user_id, call.data)
             bot.answer_callback_query(call.id, "Ошибка: данные устарели. Начните заново с команды /propose")
             return
             
@@ -410,9 +1036,7 @@ def handle_preview_buttons(call):
             # Возвращаемся к вводу имени
             set_user_state(user_id, UserStates.WAITING_NAME)
             
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            cancel_btn = types.KeyboardButton("❌ Отмена")
-            markup.add(cancel_btn)
+            markup = CANCEL_MARKUP
             
             bot.send_message(
                 call.message.chat.id,
@@ -421,18 +1045,13 @@ def handle_preview_buttons(call):
             )
             
             # Удаляем старое превью
-            try:
-                bot.delete_message(call.message.chat.id, call.message.message_id)
-            except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение: {e}")
+            safe_delete_message(call.message.chat.id, call.message.message_id)
             
         elif call.data == "edit_media":
             # Возвращаемся к отправке медиа
             set_user_state(user_id, UserStates.WAITING_MEDIA)
             
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            cancel_btn = types.KeyboardButton("❌ Отмена")
-            markup.add(cancel_btn)
+            markup = CANCEL_MARKUP
             
             bot.send_message(
                 call.message.chat.id,
@@ -441,104 +1060,74 @@ def handle_preview_buttons(call):
             )
             
             # Удаляем старое превью
-            try:
-                bot.delete_message(call.message.chat.id, call.message.message_id)
-            except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение: {e}")
+            safe_delete_message(call.message.chat.id, call.message.message_id)
             
         elif call.data == "send_proposal":
             # Проверяем наличие всех необходимых данных
-            if not user_data.get(user_id):
-                logger.warning(f"user_data пользователя {user_id} пусты при отправке предложения")
-                bot.answer_callback_query(call.id, "Ошибка: данные устарели. Начните заново с команды /propose")
-                return
-                
             required_fields = ['name', 'file_id', 'media_type']
-            missing_fields = [field for field in required_fields if field not in user_data[user_id]]
+            missing_fields = [field for field in required_fields if getattr(sess, field) is None]
             
             if missing_fields:
-                logger.warning(f"Отсутствуют поля {missing_fields} при отправке предложения пользователем {user_id}")
+                logger.warning("Отсутствуют поля %s при отправке предложения пользователем %s", missing_fields, user_id)
                 bot.answer_callback_query(call.id, f"Ошибка: неполные данные. Отсутствуют {', '.join(missing_fields)}. Начните заново.")
                 return
                 
             # Сохраняем предложение в базу данных
-            name = user_data[user_id]['name']
-            file_id = user_data[user_id]['file_id']
-            media_type = user_data[user_id]['media_type']
+            name = sess.name
+            file_id = sess.file_id
+            media_type = sess.media_type
+            media_msg_id = sess.media_msg_id
             
-            conn = None
             try:
-                conn = sqlite3.connect('facemash.db')
-                c = conn.cursor()
-                
-                logger.info(f"Сохранение предложения от пользователя {user_id}: {name}, {media_type}")
-                
-                c.execute("""
-                    INSERT INTO suggestions (name, file_id, media_type, suggested_by, status)
-                    VALUES (?, ?, ?, ?, 'pending')
-                """, (name, file_id, media_type, user_id))
-                
-                suggestion_id = c.lastrowid
-                conn.commit()
-                
-                # Уведомляем админа
-                admin_markup = types.InlineKeyboardMarkup(row_width=2)
-                accept_btn = types.InlineKeyboardButton("✅ Принять", callback_data=f"accept_suggestion_{suggestion_id}")
-                reject_btn = types.InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_suggestion_{suggestion_id}")
-                admin_markup.add(accept_btn, reject_btn)
-                
-                admin_caption = f"📝 Новое предложение!\n\n👤 Имя: {name}\n👤 От: {user_id}"
-                
-                try:
-                    if media_type == 'photo':
-                        bot.send_photo(ADMIN_ID, file_id, caption=admin_caption, reply_markup=admin_markup)
-                    else:
-                        bot.send_video(ADMIN_ID, file_id, caption=admin_caption, reply_markup=admin_markup)
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке уведомления админу: {e}")
-                    # Предложение уже сохранено, поэтому продолжаем
-                    
-                # Очищаем данные пользователя
-                set_user_state(user_id, UserStates.START)
-                user_data.pop(user_id, None)
-                
-                # Удаляем превью и отправляем подтверждение
-                try:
-                    bot.delete_message(call.message.chat.id, call.message.message_id)
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить сообщение: {e}")
+                with get_conn() as conn, write_transaction(conn):
+                    logger.info("Сохранение предложения от пользователя %s: %s, %s", user_id, name, media_type)
                     
-                bot.send_message(
-                    call.message.chat.id,
-                    "✅ Ваше предложение отправлено на рассмотрение администратору!",
-                    reply_markup=types.ReplyKeyboardRemove()
-                )
-                
-                bot.answer_callback_query(call.id, "Предложение отправлено!")
-                
+                    suggestion_id = conn.execute(
+                        SQL_INSERT_SUGGESTION, (name, pack_file_ref(file_id, media_type), user_id)
+                    ).lastrowid
+                invalidate_statistics('counts')
             except sqlite3.Error as db_err:
-                logger.error(f"Ошибка базы данных в handle_preview_buttons: {db_err}")
+                logger.error("Ошибка базы данных в handle_preview_buttons: %s", db_err)
                 bot.answer_callback_query(call.id, "Произошла ошибка при сохранении предложения")
-                if conn:
-                    conn.rollback()
                 return
-            finally:
-                if conn:
-                    conn.close()
+                
+            # Уведомляем админа (уведомление уйдет в фоне вместе с другими накопившимися)
+            queue_admin_notification(suggestion_id, name, user_id, file_id, media_type,
+                                     call.message.chat.id, media_msg_id)
+                
+            # Очищаем данные пользователя
+            reset_session(user_id)
+            
+            # Удаляем превью и отправляем подтверждение
+            safe_delete_message(call.message.chat.id, call.message.message_id)
+                
+            bot.send_message(
+                call.message.chat.id,
+                "✅ Ваше предложение отправлено на рассмотрение администратору!",
+                reply_markup=REMOVE_MARKUP
+            )
+            
+            bot.answer_callback_query(call.id, "Предложение отправлено!")
             
         elif call.data == "cancel_proposal":
             # Отменяем предложение
             cancel_proposal_callback(call)
             bot.answer_callback_query(call.id, "Предложение отменено")
             
+    except apihelper.ApiException as e:
+        # Ошибки Telegram API (лимиты, удаленные сообщения) ожидаемы, трейс не нужен
+        logger.warning("Ошибка Telegram API в handle_preview_buttons: %s", e)
+        try:
+            bot.answer_callback_query(call.id, "Произошла ошибка")
+        except apihelper.ApiException:
+            pass
     except Exception as e:
-        logger.error(f"Ошибка в handle_preview_buttons: {e}", exc_info=True)
+        logger.exception("Ошибка в handle_preview_buttons: %s", e)
         bot.answer_callback_query(call.id, "Произошла ошибка")
         # Очищаем данные пользователя при ошибке
         try:
             if 'user_id' in locals():
-                set_user_state(user_id, UserStates.START)
-                user_data.pop(user_id, None)
+                reset_session(user_id)
         except:
             pass
 
@@ -548,27 +1137,23 @@ def cancel_proposal_callback(call):
         user_id = call.from_user.id
         
         # Очищаем данные пользователя
-        set_user_state(user_id, UserStates.START)
-        user_data.pop(user_id, None)
+        reset_session(user_id)
         
         # Удаляем сообщение с превью
-        try:
-            bot.delete_message(call.message.chat.id, call.message.message_id)
-        except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение при отмене: {e}")
+        safe_delete_message(call.message.chat.id, call.message.message_id)
             
         bot.send_message(
             call.message.chat.id,
             "❌ Предложение отменено",
-            reply_markup=types.ReplyKeyboardRemove()
+            reply_markup=REMOVE_MARKUP
         )
         
     except Exception as e:
-        logger.error(f"Ошибка в cancel_proposal_callback: {e}")
+        logger.error("Ошибка в cancel_proposal_callback: %s", e)
         bot.send_message(call.message.chat.id, "Произошла ошибка при отмене предложения")
 
 # Функция для проверки подписки на канал
-def check_subscription(user_id):
+def _fetch_subscription(user_id):
     """Функция-заглушка, всегда разрешает доступ
     
     Args:
@@ -577,11 +1162,40 @@ def check_subscription(user_id):
     Returns:
         bool: Всегда True
     """
-    # Добавляем пользователя в список разрешенных без проверки
-    if user_id not in ALLOWED_USERS:
-        ALLOWED_USERS.append(user_id)
     return True
 
+def check_subscription(user_id):
+    """Проверяет подписку с кэшированием результата на SUBSCRIPTION_CACHE_TTL секунд
+    
+    Args:
+        user_id: ID пользователя Telegram
+        
+    Returns:
+        bool: True, если пользователь подписан
+    """
+    cached = _subscription_cache.get(user_id)
+    now = time.monotonic()
+    if cached is not None and cached[1] > now:
+        subscription_ok = cached[0]
+    else:
+        subscription_ok = _fetch_subscription(user_id)
+        _subscription_cache[user_id] = (subscription_ok, now + SUBSCRIPTION_CACHE_TTL)
+        
+    if subscription_ok:
+        ALLOWED_USERS.add(user_id)
+    return subscription_ok
+
+def invalidate_subscription_cache(user_id):
+    """Сбрасывает закэшированный результат проверки подписки пользователя"""
+    _subscription_cache.pop(user_id, None)
+
+def is_subscribed(update):
+    """Возвращает результат проверки подписки, уже выполненной в middleware"""
+    subscription_ok = getattr(update, 'subscription_ok', None)
+    if subscription_ok is None:
+        subscription_ok = check_subscription(update.from_user.id)
+    return subscription_ok
+
 # Функция для отправки сообщения о необходимости подписки
 def send_subscription_message(chat_id):
     """Отправляет сообщение с просьбой подписаться на канал
@@ -590,24 +1204,16 @@ def send_subscription_message(chat_id):
         chat_id: ID чата пользователя
     """
     try:
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        channel_btn = types.InlineKeyboardButton("👉 Подписаться на канал", url="https://t.me/Simpatia_Liven57")
-        markup.add(channel_btn)
-        
         # Отправляем сообщение с просьбой подписаться
         bot.send_message(
             chat_id,
-            f"👋 <b>Добро пожаловать в бот конкурса красоты!</b>\n\n"
-            f"🔔 <b>Пожалуйста, подпишитесь на наш канал:</b>\n"
-            f"@Simpatia_Liven57\n\n"
-            f"Там вы найдете актуальную информацию о конкурсах и победителях.",
-            parse_mode="HTML",
-            reply_markup=markup
+            WELCOME_HTML,
+            reply_markup=CHANNEL_MARKUP
         )
         
-        logger.info(f"Отправлено информационное сообщение о канале пользователю {chat_id}")
+        logger.info("Отправлено информационное сообщение о канале пользователю %s", chat_id)
     except Exception as e:
-        logger.error(f"Ошибка при отправке сообщения о канале: {e}")
+        logger.error("Ошибка при отправке сообщения о канале: %s", e)
         # В случае ошибки отправляем простое сообщение без форматирования
         try:
             bot.send_message(
@@ -617,150 +1223,328 @@ def send_subscription_message(chat_id):
         except:
             pass
 
+# Уведомления администратору о новых предложениях копятся в очереди и отправляются
+# фоновым потоком пачками, чтобы всплеск предложений не упирался в лимит Telegram API
+ADMIN_NOTIFY_INTERVAL = 1
+ADMIN_NOTIFY_BATCH = 10
+# Неотправленная пачка возвращается в очередь; после стольких неудачных попыток
+# уведомление о предложении отбрасывается (оно остается в списке предложений)
+ADMIN_NOTIFY_MAX_ATTEMPTS = 5
+_PENDING_ADMIN_NOTIFS = collections.deque()
+_admin_notify_attempts = {}
+
+# Префиксы callback_data решений по предложениям: префикс + id предложения ("a42", "r42")
+SUGGESTION_ACTIONS = {'a': 'accept', 'r': 'reject'}
+
+def suggestion_callbacks(suggestion_id):
+    """Возвращает callback_data кнопок принятия и отклонения предложения"""
+    return f"a{suggestion_id}", f"r{suggestion_id}"
+
+def is_suggestion_callback(data):
+    """Проверяет, что callback_data - решение по предложению"""
+    return data[:1] in SUGGESTION_ACTIONS and data[1:].isdigit()
+
+# Предложения из последнего показанного администратору списка: кнопка "Принять все"
+# ссылается на список по номеру, а id в callback_data не помещаются
+_shown_suggestions = {'listing': 0, 'ids': ()}
+_shown_suggestions_lock = threading.Lock()
+
+def remember_shown_suggestions(suggestion_ids):
+    """Запоминает доставленные администратору предложения и возвращает номер списка"""
+    with _shown_suggestions_lock:
+        _shown_suggestions['listing'] += 1
+        _shown_suggestions['ids'] = tuple(suggestion_ids)
+        return _shown_suggestions['listing']
+
+def get_shown_suggestions(listing):
+    """Возвращает id предложений списка или None, если список уже не последний"""
+    with _shown_suggestions_lock:
+        if listing != _shown_suggestions['listing']:
+            return None
+        return _shown_suggestions['ids']
+
+def accept_all_suggestions_markup(listing):
+    """Создает клавиатуру списка предложений с кнопкой "Принять все" """
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(
+        "✅ Принять все", callback_data=f"acceptall_{listing}"))
+    markup.add(types.InlineKeyboardButton(
+        "🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin"))
+    return markup
+
+def suggestion_decision_markup(suggestion_id):
+    """Создает клавиатуру принятия/отклонения одного предложения"""
+    accept_data, reject_data = suggestion_callbacks(suggestion_id)
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    accept_btn = types.InlineKeyboardButton("✅ Принять", callback_data=accept_data)
+    reject_btn = types.InlineKeyboardButton("❌ Отклонить", callback_data=reject_data)
+    markup.add(accept_btn, reject_btn)
+    return markup
+
+def queue_admin_notification(suggestion_id, name, user_id, file_id, media_type, from_chat_id, message_id):
+    """Ставит уведомление о новом предложении в очередь на отправку администратору"""
+    _PENDING_ADMIN_NOTIFS.append((suggestion_id, name, user_id, file_id, media_type, from_chat_id, message_id))
+
+def _send_admin_notifications(batch):
+    """Отправляет администратору пачку уведомлений о предложениях"""
+    if len(batch) == 1:
+        suggestion_id, name, user_id, file_id, media_type, from_chat_id, message_id = batch[0]
+        caption = ADMIN_SUGGESTION_CAPTION.format(name=name, user_id=user_id)
+        markup = suggestion_decision_markup(suggestion_id)
+        throttle_send(ADMIN_ID)
+        try:
+            # Копия исходного сообщения не требует повторной загрузки медиа
+            send_with_retry(bot.copy_message, ADMIN_ID, from_chat_id, message_id, caption=caption, reply_markup=markup)
+        except apihelper.ApiException as e:
+            # Пользователь мог удалить исходное сообщение - отправляем медиа по file_id
+            logger.warning("Не удалось скопировать сообщение с предложением #%s: %s", suggestion_id, e)
+            if media_type == 'photo':
+                send_with_retry(bot.send_photo, ADMIN_ID, file_id, caption=caption, reply_markup=markup)
+            else:
+                send_with_retry(bot.send_video, ADMIN_ID, file_id, caption=caption, reply_markup=markup)
+        return
+        
+    # Несколько предложений: один альбом с медиа и одно сообщение с кнопками
+    media = []
+    lines = []
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    for suggestion_id, name, user_id, file_id, media_type, _, _ in batch:
+        caption = f"📝 #{suggestion_id} {name}"
+        media.append(input_media(file_id, media_type, caption))
+        lines.append(f"#{suggestion_id} 👤 {name} (от {user_id})")
+        accept_data, reject_data = suggestion_callbacks(suggestion_id)
+        markup.row(
+            types.InlineKeyboardButton(f"✅ {name}", callback_data=accept_data),
+            types.InlineKeyboardButton(f"❌ {name}", callback_data=reject_data)
+        )
+        
+    throttle_send(ADMIN_ID, len(media) + 1)
+    send_with_retry(bot.send_media_group, ADMIN_ID, media)
+    send_with_retry(
+        bot.send_message,
+        ADMIN_ID,
+        f"📝 Новые предложения ({len(batch)}):\n\n" + "\n".join(lines),
+        reply_markup=markup
+    )
+
+def _admin_notifier_loop():
+    """Периодически отправляет накопившиеся уведомления администратору"""
+    while True:
+        time.sleep(ADMIN_NOTIFY_INTERVAL)
+        batch = []
+        while _PENDING_ADMIN_NOTIFS and len(batch) < ADMIN_NOTIFY_BATCH:
+            batch.append(_PENDING_ADMIN_NOTIFS.popleft())
+        if not batch:
+            continue
+        try:
+            _send_admin_notifications(batch)
+        except Exception as e:
+            logger.error("Ошибка при отправке уведомлений админу: %s", e)
+            _requeue_admin_notifications(batch)
+        else:
+            for item in batch:
+                _admin_notify_attempts.pop(item[0], None)
+
+def _requeue_admin_notifications(batch):
+    """Возвращает неотправленную пачку в начало очереди, пока не исчерпаны попытки"""
+    retry = []
+    for item in batch:
+        suggestion_id = item[0]
+        attempts = _admin_notify_attempts.get(suggestion_id, 0) + 1
+        if attempts >= ADMIN_NOTIFY_MAX_ATTEMPTS:
+            _admin_notify_attempts.pop(suggestion_id, None)
+            logger.error("Уведомление о предложении #%s не отправлено после %s попыток", suggestion_id, attempts)
+        else:
+            _admin_notify_attempts[suggestion_id] = attempts
+            retry.append(item)
+    _PENDING_ADMIN_NOTIFS.extendleft(reversed(retry))
+
+def start_admin_notifier():
+    """Запускает фоновый поток отправки уведомлений администратору"""
+    thread = threading.Thread(target=_admin_notifier_loop, name="admin-notifier", daemon=True)
+    thread.start()
+    return thread
+
+def remove_suggestion_buttons(message, suggestion_id):
+    """Убирает кнопки обработанного предложения из сообщения администратора
+    
+    Сообщение с одним предложением удаляется целиком, в сводке по нескольким
+    предложениям удаляется только строка с кнопками этого предложения.
+    """
+    callbacks = suggestion_callbacks(suggestion_id)
+    rows = message.reply_markup.keyboard if message.reply_markup else []
+    remaining = [row for row in rows if not any(btn.callback_data in callbacks for btn in row)]
+    
+    try:
+        if remaining:
+            markup = types.InlineKeyboardMarkup()
+            for row in remaining:
+                markup.row(*row)
+            bot.edit_message_reply_markup(message.chat.id, message.message_id, reply_markup=markup)
+        else:
+            safe_delete_message(message.chat.id, message.message_id)
+    except Exception as e:
+        logger.error("Ошибка при удалении сообщения: %s", e)
+
 # Обработчик принятия/отклонения предложений
-@bot.callback_query_handler(func=lambda call: call.data.startswith(('accept_suggestion_', 'reject_suggestion_')))
 def handle_suggestion_decision(call):
-    conn = None
     try:
         if call.from_user.id != ADMIN_ID:
             bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
             return
             
-        # Улучшенный парсинг callback_data
-        parts = call.data.split('_')
-        if len(parts) < 3:
-            logger.error(f"Неверный формат callback_data: {call.data}")
-            bot.answer_callback_query(call.id, "Ошибка формата данных")
-            return
-            
-        action = parts[0]
-        suggestion_id = int(parts[2])
+        # callback_data: однобуквенный префикс действия + id предложения
+        action = SUGGESTION_ACTIONS[call.data[0]]
+        suggestion_id = int(call.data[1:])
         
-        logger.info(f"Обработка {action} для предложения {suggestion_id}")
+        logger.info("Обработка %s для предложения %s", action, suggestion_id)
         
-        conn = sqlite3.connect('facemash.db')
-        conn.row_factory = sqlite3.Row  # Для более удобного доступа к данным
-        c = conn.cursor()
+        with get_conn() as conn:
+            try:
+                # Проверка статуса и запись идут в одной транзакции,
+                # чтобы повторное нажатие не обработало предложение дважды
+                # Ответ Telegram отправляется только после фиксации транзакции,
+                # чтобы сетевой запрос не держал блокировку записи
+                refusal = None
+                with write_transaction(conn):
+                    # Получаем информацию о предложении
+                    suggestion = conn.execute(SQL_SELECT_SUGGESTION, (suggestion_id,)).fetchone()
+                    
+                    if not suggestion:
+                        refusal = "Предложение не найдено"
+                    else:
+                        name, file_ref, suggested_by, status = suggestion
+                        
+                        # Проверяем, не обработано ли уже предложение
+                        if status != 'pending':
+                            refusal = "Это предложение уже было обработано"
+                        elif action == 'accept':
+                            # Добавляем в основную таблицу
+                            photo_id = conn.execute(SQL_INSERT_PHOTO, (name, file_ref)).lastrowid
+                            logger.info("Добавлена фотография с ID %s", photo_id)
+                            
+                            # Обновляем статус предложения
+                            conn.execute(SQL_UPDATE_SUGGESTION_STATUS, ('accepted', suggestion_id))
+                        else:  # reject
+                            # Отклоняем предложение
+                            conn.execute(SQL_UPDATE_SUGGESTION_STATUS, ('rejected', suggestion_id))
+                
+                if refusal:
+                    if not suggestion:
+                        logger.error("Предложение с ID %s не найдено", suggestion_id)
+                    bot.answer_callback_query(call.id, refusal)
+                    return
+                        
+                if action == 'accept':
+                    invalidate_approved_ids()
+                    invalidate_statistics(*STATS_PARTICIPANT_KEYS)
+                else:
+                    invalidate_statistics('counts')
+                        
+            except sqlite3.Error as e:
+                if action == 'accept':
+                    logger.error("Ошибка базы данных при принятии предложения: %s", e)
+                    bot.answer_callback_query(call.id, "Ошибка при принятии предложения")
+                else:
+                    logger.error("Ошибка базы данных при отклонении предложения: %s", e)
+                    bot.answer_callback_query(call.id, "Ошибка при отклонении предложения")
+                return
         
-        # Получаем информацию о предложении
-        c.execute("""
-            SELECT name, file_id, media_type, suggested_by, status
-            FROM suggestions 
-            WHERE id = ?
-        """, (suggestion_id,))
+        # Уведомления отправляем уже после фиксации транзакции
+        if action == 'accept':
+            try:
+                bot.send_message(
+                    suggested_by,
+                    f"✅ Ваше предложение участницы {name} было принято!"
+                )
+            except Exception as e:
+                logger.error("Ошибка при отправке уведомления пользователю %s: %s", suggested_by, e)
+            
+            bot.answer_callback_query(call.id, f"Участница {name} принята!")
+            bot.send_message(call.message.chat.id, f"✅ Участница {name} успешно добавлена в турнир!")
+        else:
+            try:
+                bot.send_message(
+                    suggested_by,
+                    f"❌ Ваше предложение участницы {name} было отклонено."
+                )
+            except Exception as e:
+                logger.error("Ошибка при отправке уведомления пользователю %s: %s", suggested_by, e)
+            
+            bot.answer_callback_query(call.id, f"Предложение {name} отклонено")
+            bot.send_message(call.message.chat.id, f"❌ Предложение участницы {name} отклонено")
         
-        suggestion = c.fetchone()
+        # Убираем кнопки обработанного предложения
+        remove_suggestion_buttons(call.message, suggestion_id)
         
-        if not suggestion:
-            logger.error(f"Предложение с ID {suggestion_id} не найдено")
-            bot.answer_callback_query(call.id, "Предложение не найдено")
+    except Exception as e:
+        logger.error("Ошибка в handle_suggestion_decision: %s", e)
+        bot.answer_callback_query(call.id, "Произошла ошибка")
+
+# Обработчик кнопки "Принять все" под списком предложений
+def handle_accept_all_suggestions(call):
+    try:
+        if call.from_user.id != ADMIN_ID:
+            bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
             return
             
-        name = suggestion['name']
-        file_id = suggestion['file_id']
-        media_type = suggestion['media_type']
-        suggested_by = suggestion['suggested_by']
-        status = suggestion['status']
-        
-        # Проверяем, не обработано ли уже предложение
-        if status != 'pending':
-            bot.answer_callback_query(call.id, "Это предложение уже было обработано")
+        # Принимаем только предложения, которые были доставлены в показанном списке
+        suggestion_ids = get_shown_suggestions(int(call.data.partition('_')[2]))
+        if suggestion_ids is None:
+            bot.answer_callback_query(call.id, "Список устарел, откройте предложения заново")
             return
+            
+        placeholders = ", ".join("?" * len(suggestion_ids))
+        with get_conn() as conn:
+            # Все предложения переносятся одной транзакцией вместо отдельной на каждое
+            with write_transaction(conn):
+                conn.execute(SQL_ACCEPT_PENDING_PHOTOS.format(ids=placeholders), suggestion_ids)
+                accepted = conn.execute(
+                    SQL_ACCEPT_PENDING_SUGGESTIONS.format(ids=placeholders), suggestion_ids
+                ).fetchall()
+                
+        if not accepted:
+            bot.answer_callback_query(call.id, "Нет необработанных предложений")
+            return
+            
+        invalidate_approved_ids()
+        invalidate_statistics(*STATS_PARTICIPANT_KEYS)
+        logger.info("Массово принято предложений: %s", len(accepted))
         
-        if action == 'accept':
-            try:
-                # Добавляем в основную таблицу
-                c.execute("""
-                    INSERT INTO photos (name, file_id, media_type, approved)
-                    VALUES (?, ?, ?, 1)
-                """, (name, file_id, media_type))
-                
-                # Получаем ID вставленной записи
-                photo_id = c.lastrowid
-                logger.info(f"Добавлена фотография с ID {photo_id}")
-                
-                # Обновляем статус предложения
-                c.execute("UPDATE suggestions SET status = 'accepted' WHERE id = ?", (suggestion_id,))
-                
-                conn.commit()
-                
-                # Уведомляем пользователя
-                try:
-                    bot.send_message(
-                        suggested_by,
-                        f"✅ Ваше предложение участницы {name} было принято!"
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке уведомления пользователю {suggested_by}: {e}")
-                
-                bot.answer_callback_query(call.id, f"Участница {name} принята!")
-                bot.send_message(call.message.chat.id, f"✅ Участница {name} успешно добавлена в турнир!")
-                
-            except sqlite3.Error as e:
-                logger.error(f"Ошибка базы данных при принятии предложения: {e}")
-                bot.answer_callback_query(call.id, "Ошибка при принятии предложения")
-                if conn:
-                    conn.rollback()
-                return
-                
-        else:  # reject
-            try:
-                # Отклоняем предложение
-                c.execute("UPDATE suggestions SET status = 'rejected' WHERE id = ?", (suggestion_id,))
-                conn.commit()
-                
-                # Уведомляем пользователя
-                try:
-                    bot.send_message(
-                        suggested_by,
-                        f"❌ Ваше предложение участницы {name} было отклонено."
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке уведомления пользователю {suggested_by}: {e}")
-                
-                bot.answer_callback_query(call.id, f"Предложение {name} отклонено")
-                bot.send_message(call.message.chat.id, f"❌ Предложение участницы {name} отклонено")
-                
-            except sqlite3.Error as e:
-                logger.error(f"Ошибка базы данных при отклонении предложения: {e}")
-                bot.answer_callback_query(call.id, "Ошибка при отклонении предложения")
-                if conn:
-                    conn.rollback()
-                return
-        
-        # Удаляем сообщение с кнопками
-        try:
-            bot.delete_message(call.message.chat.id, call.message.message_id)
-        except Exception as e:
-            logger.error(f"Ошибка при удалении сообщения: {e}")
+        for row in accepted:
+            send_message_async(row['suggested_by'], f"✅ Ваше предложение участницы {row['name']} было принято!")
+            
+        bot.answer_callback_query(call.id, f"Принято предложений: {len(accepted)}")
+        bot.send_message(
+            call.message.chat.id,
+            f"✅ В турнир добавлено участниц: {len(accepted)}",
+            reply_markup=BACK_TO_ADMIN_MARKUP
+        )
         
+    except sqlite3.Error as e:
+        logger.error("Ошибка базы данных при массовом принятии предложений: %s", e)
+        bot.answer_callback_query(call.id, "Ошибка при принятии предложений")
     except Exception as e:
-        logger.error(f"Ошибка в handle_suggestion_decision: {e}")
+        logger.error("Ошибка в handle_accept_all_suggestions: %s", e)
         bot.answer_callback_query(call.id, "Произошла ошибка")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
 
 # Функция отмены для текстовых сообщений
 def cancel_proposal(message):
     try:
         user_id = message.from_user.id
-        logger.info(f"Отмена предложения пользователем {user_id} через команду")
+        logger.info("Отмена предложения пользователем %s через команду", user_id)
         
         # Очищаем данные пользователя
-        set_user_state(user_id, UserStates.START)
-        user_data.pop(user_id, None)
+        reset_session(user_id)
         
         bot.send_message(
             message.chat.id,
             "❌ Предложение отменено",
-            reply_markup=types.ReplyKeyboardRemove()
+            reply_markup=REMOVE_MARKUP
         )
         
     except Exception as e:
-        logger.error(f"Ошибка в cancel_proposal: {e}")
+        logger.error("Ошибка в cancel_proposal: %s", e)
         bot.reply_to(message, "Произошла ошибка при отмене предложения")
 
 # Улучшаем обработку команды /start
@@ -768,37 +1552,32 @@ def cancel_proposal(message):
 def start_command(message):
     try:
         user_id = message.from_user.id
-        logger.info(f"Команда /start от пользователя {user_id}")
+        logger.info("Команда /start от пользователя %s", user_id)
         
         # Сбрасываем состояние, если пользователь был в процессе предложения
-        if user_id in user_states and user_states[user_id] != UserStates.START:
-            logger.info(f"Сброс состояния пользователя {user_id} с {user_states[user_id]} на START")
-            set_user_state(user_id, UserStates.START)
-            user_data.pop(user_id, None)
+        current_state = get_user_state(user_id)
+        if current_state != UserStates.START:
+            logger.info("Сброс состояния пользователя %s с %s на START", user_id, current_state)
+            reset_session(user_id)
         
         # Отправляем сообщение с просьбой подписаться на канал
         send_subscription_message(message.chat.id)
         
         # Добавляем пользователя в список разрешенных (без проверки подписки)
-        if user_id not in ALLOWED_USERS:
-            ALLOWED_USERS.append(user_id)
+        ALLOWED_USERS.add(user_id)
             
         # Создаем соответствующую клавиатуру
-        markup = create_admin_markup() if user_id == ADMIN_ID else create_user_markup()
+        markup = ADMIN_MARKUP if user_id == ADMIN_ID else USER_MARKUP
         
         # Отправляем основное меню после сообщения о подписке
         bot.send_message(
             message.chat.id,
-            f"<b>Доступные команды:</b>\n"
-            f"🎭 <b>Начать голосование</b> - участвовать в текущем турнире\n"
-            f"🏆 <b>Топ участниц</b> - посмотреть рейтинг участниц\n"
-            f"➕ <b>Предложить участницу</b> - предложить новую участницу",
-            parse_mode="HTML",
+            START_MENU_HTML,
             reply_markup=markup
         )
         
     except Exception as e:
-        logger.error(f"Ошибка в start_command: {e}")
+        logger.error("Ошибка в start_command: %s", e)
         bot.send_message(message.chat.id, "Произошла ошибка при запуске бота")
 
 # Обработчик команды /admin
@@ -812,30 +1591,25 @@ def admin_command(message):
             return
             
         # Получаем базовую статистику для отображения
-        conn = None
         try:
-            conn = sqlite3.connect('facemash.db')
-            c = conn.cursor()
-            
-            # Количество участниц
-            c.execute("SELECT COUNT(*) FROM photos WHERE approved = 1")
-            participants_count = c.fetchone()[0]
-            
-            # Количество предложений
-            c.execute("SELECT COUNT(*) FROM suggestions WHERE status = 'pending'")
-            pending_count = c.fetchone()[0]
-            
-            # Проверяем статус турнира
-            c.execute("SELECT is_active FROM tournament_settings WHERE is_active = 1")
-            tournament_active = bool(c.fetchone())
-            
-            conn.close()
-        except:
+            with get_conn() as conn:
+                c = conn.cursor()
+                
+                # Количество участниц
+                c.execute("SELECT COUNT(*) FROM photos WHERE approved = 1")
+                participants_count = c.fetchone()[0]
+                
+                # Количество предложений
+                c.execute("SELECT COUNT(*) FROM suggestions WHERE status = 'pending'")
+                pending_count = c.fetchone()[0]
+                
+                # Проверяем статус турнира
+                c.execute("SELECT is_active FROM tournament_settings WHERE is_active = 1")
+                tournament_active = bool(c.fetchone())
+        except sqlite3.Error:
             participants_count = "?"
             pending_count = "?"
             tournament_active = False
-            if conn:
-                conn.close()
         
         markup = types.InlineKeyboardMarkup(row_width=2)
         
@@ -875,22 +1649,18 @@ def admin_command(message):
         markup.row(btn7, btn8)
         markup.add(btn9)
         
-        status_emoji = "✅" if tournament_active else "❌"
-        
         bot.reply_to(
             message,
-            f"👑 *АДМИН-ПАНЕЛЬ*\n\n"
-            f"📊 *Статистика:*\n"
-            f"• Участниц: {participants_count}\n"
-            f"• Ожидают проверки: {pending_count}\n"
-            f"• Статус турнира: {status_emoji} {'Активен' if tournament_active else 'Не активен'}\n\n"
-            f"Выберите действие:",
-            parse_mode="Markdown",
+            ADMIN_PANEL_TEMPLATE.format(
+                participants_count=participants_count,
+                pending_count=pending_count,
+                tournament_status="✅ Активен" if tournament_active else "❌ Не активен"
+            ),
             reply_markup=markup
         )
         
     except Exception as e:
-        logger.error(f"Ошибка в admin_command: {e}", exc_info=True)
+        logger.exception("Ошибка в admin_command: %s", e)
         bot.reply_to(message, "Произошла ошибка при открытии админ-панели. Проверьте логи.")
 
 # Обработчик команды /cancel
@@ -901,54 +1671,40 @@ def cancel_command(message):
         cancel_proposal(message)
         
     except Exception as e:
-        logger.error(f"Ошибка в cancel_command: {e}")
+        logger.error("Ошибка в cancel_command: %s", e)
         bot.reply_to(message, "Произошла ошибка при отмене действия")
 
+def open_admin_panel(message):
+    """Открывает админ-панель по кнопке меню, если пользователь - администратор"""
+    if message.from_user.id == ADMIN_ID:
+        admin_command(message)
+    else:
+        bot.send_message(message.chat.id, "У вас нет доступа к админ-панели.")
+
 # Изменяем обработчик текстовых команд для проверки подписки
 @bot.message_handler(func=lambda message: True)
+@require_subscription
+@serialized_per_user
 def handle_text(message):
     try:
         user_id = message.from_user.id
         
-        # Проверяем подписку на канал перед любым действием
-        if not check_subscription(user_id):
-            send_subscription_message(message.chat.id)
-            return
-            
-        # Если пользователь подписан, добавляем его в список разрешенных
-        if user_id not in ALLOWED_USERS:
-            ALLOWED_USERS.append(user_id)
-            
-        if message.text == "🎭 Начать голосование":
-            start_voting(message)
-        elif message.text == "🏆 Топ участниц" or message.text == "📊 Топ фото":
-            show_top(message)
-        elif message.text == "➕ Предложить участницу":
-            start_proposal(message)
-        elif message.text == "👑 Админ-панель":
-            if user_id == ADMIN_ID:
-                admin_command(message)
-            else:
-                bot.send_message(message.chat.id, "У вас нет доступа к админ-панели.")
-        elif message.text == "🔧 Сообщить о поломке":
-            handle_report_bug(message)
-        else:
+        route = TEXT_ROUTES.get(message.text)
+        if route is not None:
+            route(message)
+        elif user_id in sessions:
             # Обработка текущего состояния пользователя
-            if user_id in user_states and user_id in user_data:
-                handle_user_state(message)
-            else:
-                bot.send_message(message.chat.id, "Используйте кнопки для навигации по боту.")
+            handle_user_state(message)
+        else:
+            bot.send_message(message.chat.id, "Используйте кнопки для навигации по боту.")
     except Exception as e:
-        logging.error(f"Ошибка при обработке сообщения: {e}")
+        logger.error("Ошибка при обработке сообщения: %s", e)
         bot.send_message(message.chat.id, "Произошла ошибка при обработке вашего сообщения.")
 
-@bot.message_handler(func=lambda message: message.text == "🔧 Сообщить о поломке")
 def handle_report_bug(message):
     """Обработчик кнопки сообщения о поломке"""
     try:
-        markup = types.InlineKeyboardMarkup()
-        contact_button = types.InlineKeyboardButton("Написать разработчику", url="https://t.me/cloudysince")
-        markup.add(contact_button)
+        markup = REPORT_BUG_MARKUP
         
         bot.reply_to(
             message,
@@ -957,49 +1713,22 @@ def handle_report_bug(message):
             reply_markup=markup
         )
     except Exception as e:
-        logger.error(f"Ошибка при обработке кнопки сообщения о поломке: {e}")
+        logger.error("Ошибка при обработке кнопки сообщения о поломке: %s", e)
         bot.reply_to(message, "Произошла ошибка при обработке вашего запроса.")
 
-@bot.message_handler(func=lambda message: message.text == "🏆 Топ участниц")
+@require_subscription
 def show_top(message):
     """Показывает топ-3 участниц с наибольшим количеством голосов"""
     try:
-        user_id = message.from_user.id
-        
-        # Проверяем подписку на канал
-        if not check_subscription(user_id):
-            markup = types.InlineKeyboardMarkup()
-            channel_btn = types.InlineKeyboardButton("Подписаться на канал", url="https://t.me/Simpatia_Liven57")
-            check_btn = types.InlineKeyboardButton("✅ Проверить подписку", callback_data="check_subscription")
-            markup.add(channel_btn)
-            markup.add(check_btn)
-            
-            bot.reply_to(
-                message,
-                "⛔ Для использования бота необходимо подписаться на канал @Simpatia_Liven57",
-                reply_markup=markup
-            )
-            return
-            
-        # Проверяем доступ пользователя
-        if user_id not in ALLOWED_USERS:
-            bot.reply_to(message, "⛔ У вас нет доступа к боту. Обратитесь к администратору.")
-            return
-        
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
         # Получаем топ-3 участниц с наибольшим количеством голосов
-        c.execute("""
-            SELECT p.id, p.name, p.file_id, p.media_type, p.votes
-            FROM photos p
-            WHERE p.approved = 1
-            ORDER BY p.votes DESC
-            LIMIT 3
-        """)
-        
-        top_participants = c.fetchall()
-        conn.close()
+        with get_conn() as conn:
+            top_participants = conn.execute("""
+                SELECT p.id, p.name, p.file_ref, p.votes
+                FROM photos p
+                WHERE p.approved = 1
+                ORDER BY p.votes DESC
+                LIMIT 3
+            """).fetchall()
         
         if not top_participants:
             bot.reply_to(message, "🏆 В данный момент нет участниц в рейтинге")
@@ -1008,215 +1737,206 @@ def show_top(message):
         # Отправляем сообщение с заголовком
         bot.send_message(
             message.chat.id,
-            "🏆 *ТОП-3 УЧАСТНИЦ*\n\n"
-            "_Участницы с наибольшим количеством голосов:_",
-            parse_mode="Markdown"
+            "🏆 <b>ТОП-3 УЧАСТНИЦ</b>\n\n"
+            "<i>Участницы с наибольшим количеством голосов:</i>"
         )
         
-        # Отправляем информацию о каждой участнице
-        for i, (photo_id, name, file_id, media_type, votes) in enumerate(top_participants, 1):
+        # Готовим подписи и медиа для всех мест
+        entries = []
+        for i, (photo_id, name, file_ref, votes) in enumerate(top_participants, 1):
+            file_id, media_type = unpack_file_ref(file_ref)
             medal = {1: "🥇", 2: "🥈", 3: "🥉"}[i]
-            caption = f"{medal} *{i} место*\n👤 {name}\n📊 Голосов: {votes}"
-            
+            caption = f"{medal} <b>{i} место</b>\n👤 {name}\n📊 Голосов: {votes}"
+            entries.append((name, file_id, media_type, caption))
+        
+        # Альбомом за один запрос; альбом требует минимум два элемента
+        if len(entries) > 1:
+            media = [input_media(file_id, media_type, caption)
+                     for name, file_id, media_type, caption in entries]
+            try:
+                bot.send_media_group(message.chat.id, media)
+                return
+            except Exception as group_error:
+                logger.warning("Не удалось отправить топ альбомом, отправляем по одной: %s", group_error)
+        
+        # Отправляем информацию о каждой участнице отдельно
+        for name, file_id, media_type, caption in entries:
             try:
                 if media_type == 'photo':
-                    bot.send_photo(message.chat.id, file_id, caption=caption, parse_mode="Markdown")
+                    bot.send_photo(message.chat.id, file_id, caption=caption)
                 elif media_type == 'video':
-                    bot.send_video(message.chat.id, file_id, caption=caption, parse_mode="Markdown")
+                    bot.send_video(message.chat.id, file_id, caption=caption)
             except Exception as media_error:
-                logger.error(f"Ошибка при отправке медиа для участницы {name}: {media_error}")
+                logger.error("Ошибка при отправке медиа для участницы %s: %s", name, media_error)
                 bot.send_message(
                     message.chat.id,
-                    f"{caption}\n\n❌ _Ошибка при загрузке медиафайла_",
-                    parse_mode="Markdown"
+                    f"{caption}\n\n❌ <i>Ошибка при загрузке медиафайла</i>"
                 )
                 
     except Exception as e:
-        logger.error(f"Ошибка при показе топ участниц: {e}")
+        logger.error("Ошибка при показе топ участниц: %s", e)
         bot.reply_to(message, "Произошла ошибка при получении рейтинга участниц.")
 
+@require_subscription
+@serialized_per_user
 def start_voting(message):
     try:
         user_id = message.from_user.id
         
-        # Проверяем подписку на канал
-        if not check_subscription(user_id):
-            markup = types.InlineKeyboardMarkup()
-            channel_btn = types.InlineKeyboardButton("Подписаться на канал", url="https://t.me/Simpatia_Liven57")
-            check_btn = types.InlineKeyboardButton("✅ Проверить подписку", callback_data="check_subscription")
-            markup.add(channel_btn)
-            markup.add(check_btn)
-            
-            bot.reply_to(
-                message,
-                "⛔ Для использования бота необходимо подписаться на канал @Simpatia_Liven57",
-                reply_markup=markup
-            )
-            return
-            
-        # Проверяем доступ пользователя
-        if user_id not in ALLOWED_USERS:
-            bot.reply_to(message, "⛔ У вас нет доступа к боту. Обратитесь к администратору.")
-            return
-        
         # Проверяем, есть ли активный турнир
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
-        c.execute("SELECT id FROM tournament_settings WHERE is_active = 1")
-        tournament = c.fetchone()
-        
-        if not tournament:
+        if not get_active_tournament():
             bot.reply_to(message, "🚫 В данный момент нет активного турнира")
-            conn.close()
             return
             
-        # Получаем две случайные участницы
-        c.execute("""
-            SELECT p.id, p.name, p.file_id, p.media_type, p.votes
-            FROM photos p
-            WHERE p.approved = 1
-            AND NOT EXISTS (
-                SELECT 1 FROM user_votes v
-                WHERE v.user_id = ? AND v.photo_id = p.id
-            )
-            ORDER BY RANDOM()
-            LIMIT 2
-        """, (user_id,))
-        
-        participants = c.fetchall()
-        conn.close()
+        with get_conn() as conn:
+            voted = get_voted_ids(user_id, conn)
+            
+            # Выбираем две случайные участницы, за которых пользователь еще не голосовал
+            candidates = [photo_id for photo_id in get_approved_ids() if photo_id not in voted]
+            participants = []
+            if len(candidates) >= 2:
+                chosen = random.sample(candidates, 2)
+                participants = conn.execute("""
+                    SELECT id, name, file_ref, votes
+                    FROM photos
+                    WHERE id IN (?, ?) AND approved = 1
+                """, chosen).fetchall()
         
         if len(participants) < 2:
             bot.reply_to(message, "🏁 Вы уже проголосовали за всех участниц!")
             return
             
-        # Отправляем фото/видео для голосования
-        for participant in participants:
-            part_id, name, file_id, media_type, votes = participant
-            
-            markup = types.InlineKeyboardMarkup()
-            vote_btn = types.InlineKeyboardButton("👍 Голосовать", callback_data=f"vote_{part_id}")
-            markup.add(vote_btn)
-            
-            caption = f"👤 {name}\n📊 Текущие голоса: {votes}"
-            
-            if media_type == 'photo':
-                bot.send_photo(message.chat.id, file_id, caption=caption, reply_markup=markup)
-            else:
-                bot.send_video(message.chat.id, file_id, caption=caption, reply_markup=markup)
+        # Отправляем фото/видео для голосования параллельно: порядок пары не важен
+        chat_id = message.chat.id
+        list(_SEND_EXECUTOR.map(lambda participant: _send_vote_participant(chat_id, participant), participants))
                 
     except Exception as e:
-        logger.error(f"Ошибка в start_voting: {e}")
+        logger.error("Ошибка в start_voting: %s", e)
         bot.reply_to(message, "Произошла ошибка при начале голосования")
 
+def _send_vote_participant(chat_id, participant):
+    """Отправляет участницу с кнопкой голосования"""
+    part_id, name, file_ref, votes = participant
+    file_id, media_type = unpack_file_ref(file_ref)
+    
+    markup = types.InlineKeyboardMarkup()
+    vote_btn = types.InlineKeyboardButton("👍 Голосовать", callback_data=f"vote_{part_id}")
+    markup.add(vote_btn)
+    
+    caption = f"👤 {name}\n📊 Текущие голоса: {votes}"
+    
+    throttle_send(chat_id)
+    if media_type == 'photo':
+        send_with_retry(bot.send_photo, chat_id, file_id, caption=caption, reply_markup=markup)
+    else:
+        send_with_retry(bot.send_video, chat_id, file_id, caption=caption, reply_markup=markup)
+
+# Кнопки главного меню и их обработчики для handle_text
+TEXT_ROUTES = {
+    "🎭 Начать голосование": start_voting,
+    "🏆 Топ участниц": show_top,
+    "📊 Топ фото": show_top,
+    "➕ Предложить участницу": start_proposal,
+    "👑 Админ-панель": open_admin_panel,
+    "🔧 Сообщить о поломке": handle_report_bug,
+}
+
+class ParticipantNotFound(Exception):
+    """Участница, за которую голосуют, не найдена или не одобрена"""
+
 # Обработчик голосования
-@bot.callback_query_handler(func=lambda call: call.data.startswith('vote_'))
+@require_subscription
+@serialized_per_user
 def handle_vote(call):
-    conn = None
     try:
         user_id = call.from_user.id
         
-        # Проверяем подписку на канал перед любым действием
-        if not check_subscription(user_id):
-            bot.answer_callback_query(call.id, "⛔ Для голосования необходимо подписаться на канал!", show_alert=True)
-            send_subscription_message(call.message.chat.id)
-            return
-            
-        # Если пользователь подписан, добавляем его в список разрешенных
-        if user_id not in ALLOWED_USERS:
-            ALLOWED_USERS.append(user_id)
-        
         photo_id = int(call.data.split('_')[1])
         
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
         # Проверяем, есть ли активный турнир
-        cursor.execute("SELECT id FROM tournament_settings WHERE is_active = 1")
-        if not cursor.fetchone():
+        tournament = get_active_tournament()
+        if not tournament:
             bot.answer_callback_query(call.id, "🚫 В данный момент нет активного турнира")
             return
+        required = tournament[1]
         
-        # Проверяем, не голосовал ли уже пользователь за это фото
-        cursor.execute("SELECT id FROM user_votes WHERE user_id = ? AND photo_id = ?", (user_id, photo_id))
-        if cursor.fetchone():
-            bot.answer_callback_query(call.id, "Вы уже голосовали за эту участницу!")
-            return
-            
-        # Проверяем существование фото и получаем имя участницы
-        cursor.execute("SELECT id, name FROM photos WHERE id = ? AND approved = 1", (photo_id,))
-        photo_data = cursor.fetchone()
-        if not photo_data:
+        # Добавляем голос и увеличиваем счетчик участницы в одной транзакции
+        already_voted = False
+        try:
+            with get_conn() as conn, write_transaction(conn):
+                # Первичный ключ (user_id, photo_id) сам отсекает повторный голос
+                if conn.execute(SQL_INSERT_VOTE, (user_id, photo_id)).rowcount == 0:
+                    already_voted = True
+                else:
+                    photo_data = conn.execute(SQL_ADD_PHOTO_VOTE, (photo_id,)).fetchone()
+                    if photo_data is None:
+                        # Участница не найдена - write_transaction откатит вставленный голос
+                        raise ParticipantNotFound(photo_id)
+        except ParticipantNotFound:
             bot.answer_callback_query(call.id, "Участница не найдена или не одобрена")
             return
+                    
+        if already_voted:
+            bot.answer_callback_query(call.id, "Вы уже голосовали за эту участницу!")
+            return
             
-        photo_name = photo_data[1]
-            
-        # Добавляем голос
-        cursor.execute("INSERT INTO user_votes (user_id, photo_id) VALUES (?, ?)", (user_id, photo_id))
-        cursor.execute("UPDATE photos SET votes = votes + 1 WHERE id = ?", (photo_id,))
+        votes, photo_name = photo_data
+        remember_vote(user_id, photo_id)
         
-        # Проверяем, достигнуто ли необходимое количество голосов
-        cursor.execute("""
-            SELECT p.votes, t.required_votes 
-            FROM photos p, tournament_settings t 
-            WHERE p.id = ? AND t.is_active = 1
-        """, (photo_id,))
+        # Сначала отвечаем на callback, остальные запросы уходят в фоне
+        bot.answer_callback_query(call.id, "Ваш голос учтен!")
         
-        result = cursor.fetchone()
-        if result:
-            votes, required = result
-            
-            conn.commit()
-            
-            # Удаляем сообщение с кнопкой голосования
-            try:
-                bot.delete_message(call.message.chat.id, call.message.message_id)
-            except Exception as e:
-                logger.error(f"Ошибка при удалении сообщения голосования: {e}")
+        # Удаляем сообщение с кнопкой голосования
+        safe_delete_message(call.message.chat.id, call.message.message_id)
+        
+        if votes >= required:
+            schedule_check_tournament_completion()
             
-            if votes >= required:
-                check_tournament_completion()
-                
-            # Отправляем сообщение об успешном голосовании
-            bot.send_message(call.message.chat.id, f"✅ Вы успешно проголосовали за участницу {photo_name}! Текущее количество голосов: {votes}")
-                
-            bot.answer_callback_query(call.id, "Ваш голос учтен!")
-        else:
-            logger.error(f"Не удалось получить данные о голосах и требуемом количестве для фото {photo_id}")
-            conn.rollback()
-            bot.answer_callback_query(call.id, "Ошибка при обработке голоса")
+        # Отправляем сообщение об успешном голосовании
+        send_message_async(
+            call.message.chat.id,
+            f"✅ Вы успешно проголосовали за участницу {photo_name}! Текущее количество голосов: {votes}"
+        )
             
     except Exception as e:
-        logger.error(f"Ошибка в handle_vote: {e}")
+        logger.error("Ошибка в handle_vote: %s", e)
         bot.answer_callback_query(call.id, "Произошла ошибка при голосовании")
-        if conn:
-            conn.rollback()
+
+# Не даем нескольким голосам, перешедшим порог, проверять завершение одновременно
+_completion_lock = threading.Lock()
+
+def schedule_check_tournament_completion():
+    """Запускает проверку завершения турнира в фоне, если она еще не запущена"""
+    if _completion_lock.acquire(blocking=False):
+        _BACKGROUND_EXECUTOR.submit(_run_check_tournament_completion)
+
+def _run_check_tournament_completion():
+    try:
+        check_tournament_completion()
     finally:
-        if conn:
-            conn.close()
+        _completion_lock.release()
 
 def check_tournament_completion():
     try:
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
-        # Проверяем условия завершения турнира
-        c.execute("""
-            SELECT COUNT(*) 
-            FROM photos p, tournament_settings t
-            WHERE p.approved = 1 
-            AND t.is_active = 1 
-            AND p.votes >= t.required_votes
-        """)
-        
-        completed_count = c.fetchone()[0]
-        
-        if completed_count > 0:
+        with get_conn() as conn:
+            c = conn.cursor()
+            
+            # Проверяем условия завершения турнира
+            c.execute("""
+                SELECT COUNT(*) 
+                FROM photos p, tournament_settings t
+                WHERE p.approved = 1 
+                AND t.is_active = 1 
+                AND p.votes >= t.required_votes
+            """)
+            
+            completed_count = c.fetchone()[0]
+            if completed_count == 0:
+                return
+                
             # Определяем победителя
             c.execute("""
-                SELECT p.id, p.name, p.file_id, p.media_type, p.votes
+                SELECT p.id, p.name, p.file_ref, p.votes
                 FROM photos p
                 WHERE p.approved = 1
                 ORDER BY p.votes DESC
@@ -1224,40 +1944,70 @@ def check_tournament_completion():
             """)
             
             winner = c.fetchone()
-            
-            if winner:
-                winner_id, name, file_id, media_type, votes = winner
-                
-                # Завершаем турнир
-                c.execute("UPDATE tournament_settings SET is_active = 0 WHERE is_active = 1")
-                conn.commit()
+            if not winner:
+                return
                 
-                # Отправляем уведомление о победителе
-                caption = (f"🎉 Турнир завершен!\n\n"
-                          f"👑 Победитель: {name}\n"
-                          f"📊 Набрано голосов: {votes}")
-                          
-                if media_type == 'photo':
-                    bot.send_photo(ADMIN_ID, file_id, caption=caption)
-                else:
-                    bot.send_video(ADMIN_ID, file_id, caption=caption)
-                    
-        conn.close()
+            # Завершаем турнир; если его уже завершили, победителя не объявляем повторно
+            c.execute("UPDATE tournament_settings SET is_active = 0 WHERE is_active = 1")
+            conn.commit()
+            invalidate_tournament_cache()
+            if c.rowcount == 0:
+                return
+            
+        winner_id, name, file_ref, votes = winner
+        file_id, media_type = unpack_file_ref(file_ref)
+        
+        # Отправляем уведомление о победителе
+        caption = (f"🎉 Турнир завершен!\n\n"
+                  f"👑 Победитель: {name}\n"
+                  f"📊 Набрано голосов: {votes}")
+                  
+        if media_type == 'photo':
+            bot.send_photo(ADMIN_ID, file_id, caption=caption)
+        else:
+            bot.send_video(ADMIN_ID, file_id, caption=caption)
         
     except Exception as e:
-        logger.error(f"Ошибка в check_tournament_completion: {e}")
+        logger.error("Ошибка в check_tournament_completion: %s", e)
+
+# Время "ЧЧ:ММ:СС", форматируется не чаще раза в секунду
+_hms_cache = (0, "")
+
+def current_hms():
+    """Возвращает текущее время в формате ЧЧ:ММ:СС"""
+    global _hms_cache
+    now = int(time.time())
+    second, formatted = _hms_cache
+    if now != second:
+        formatted = time.strftime("%H:%M:%S", time.localtime(now))
+        _hms_cache = (now, formatted)
+    return formatted
+
+_timestamp_cache = (0, "")
+
+def current_timestamp():
+    """Возвращает текущие дату и время в формате ГГГГ-ММ-ДД ЧЧ:ММ:СС"""
+    global _timestamp_cache
+    now = int(time.time())
+    second, formatted = _timestamp_cache
+    if now != second:
+        formatted = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+        _timestamp_cache = (now, formatted)
+    return formatted
 
 # Обработчик проверки подписки
-@bot.callback_query_handler(func=lambda call: call.data == "check_subscription")
 def check_subscription_callback(call):
     """Обработчик нажатия на кнопку проверки подписки"""
     try:
         user_id = call.from_user.id
-        logger.info(f"Проверка подписки для пользователя {user_id}")
+        logger.info("Проверка подписки для пользователя %s", user_id)
         
         # Добавляем feedback для пользователя пока проверяем подписку
         bot.answer_callback_query(call.id, "Проверяем вашу подписку...", show_alert=False)
         
+        # Пользователь мог только что подписаться - проверяем заново, минуя кэш
+        invalidate_subscription_cache(user_id)
+        
         # Оборачиваем проверку в try-except для безопасной обработки ошибок API
         subscription_verified = False
         subscription_error = False
@@ -1265,26 +2015,26 @@ def check_subscription_callback(call):
         try:
             subscription_verified = check_subscription(user_id)
         except Exception as e:
-            logger.error(f"Ошибка при проверке подписки в обработчике callback: {e}")
+            logger.error("Ошибка при проверке подписки в обработчике callback: %s", e)
             subscription_error = True
             # В случае ошибки, разрешаем доступ
             if user_id not in ALLOWED_USERS:
-                ALLOWED_USERS.append(user_id)
-                logger.info(f"Пользователь {user_id} добавлен в список разрешенных из-за ошибки проверки")
+                ALLOWED_USERS.add(user_id)
+                logger.info("Пользователь %s добавлен в список разрешенных из-за ошибки проверки", user_id)
             subscription_verified = True
         
         if subscription_verified:
             # Если пользователь подписан, добавляем его в список разрешенных
             if user_id not in ALLOWED_USERS:
-                ALLOWED_USERS.append(user_id)
-                logger.info(f"Пользователь {user_id} добавлен в список разрешенных пользователей")
+                ALLOWED_USERS.add(user_id)
+                logger.info("Пользователь %s добавлен в список разрешенных пользователей", user_id)
                 
             # Создаем соответствующую клавиатуру
-            markup = create_admin_markup() if user_id == ADMIN_ID else create_user_markup()
+            markup = ADMIN_MARKUP if user_id == ADMIN_ID else USER_MARKUP
             
             try:
                 # Используем другой текст для сообщения, чтобы избежать ошибки "message is not modified"
-                current_time = time.strftime("%H:%M:%S")
+                current_time = current_hms()
                 success_text = f"✅ <b>Доступ открыт! ({current_time})</b>\n\n"
                 
                 if subscription_error:
@@ -1298,7 +2048,6 @@ def check_subscription_callback(call):
                     chat_id=call.message.chat.id,
                     message_id=call.message.message_id,
                     text=success_text,
-                    parse_mode="HTML",
                     reply_markup=None
                 )
                 
@@ -1315,7 +2064,7 @@ def check_subscription_callback(call):
                 else:
                     bot.answer_callback_query(call.id, "✅ Подписка подтверждена! Доступ открыт.")
             except Exception as edit_error:
-                logger.error(f"Ошибка при обновлении сообщения о подписке: {edit_error}")
+                logger.error("Ошибка при обновлении сообщения о подписке: %s", edit_error)
                 # Если не получится отредактировать, просто отправим новое сообщение
                 success_text = f"✅ <b>Доступ открыт!</b>\n\n"
                 if subscription_error:
@@ -1327,7 +2076,6 @@ def check_subscription_callback(call):
                 bot.send_message(
                     call.message.chat.id,
                     success_text,
-                    parse_mode="HTML",
                     reply_markup=markup
                 )
         else:
@@ -1340,7 +2088,7 @@ def check_subscription_callback(call):
             
             # Обновляем сообщение с кнопками подписки (для обновления timestamp)
             try:
-                current_time = time.strftime("%H:%M:%S")
+                current_time = current_hms()
                 markup = types.InlineKeyboardMarkup(row_width=1)
                 channel_btn = types.InlineKeyboardButton("👉 Подписаться на канал", url="https://t.me/Simpatia_Liven57")
                 check_btn = types.InlineKeyboardButton(f"✅ Проверить подписку ({current_time})", callback_data="check_subscription")
@@ -1352,45 +2100,39 @@ def check_subscription_callback(call):
                     chat_id=call.message.chat.id,
                     message_id=call.message.message_id,
                     text=f"⚠️ <b>Для использования бота необходима подписка ({current_time})</b>\n\nПожалуйста, подпишитесь на наш канал и нажмите кнопку проверки подписки.",
-                    parse_mode="HTML",
                     reply_markup=markup
                 )
             except Exception as markup_error:
-                logger.error(f"Ошибка при обновлении клавиатуры: {markup_error}")
                 # Логируем ошибку с трейсом для отладки
-                logger.error(f"Детали ошибки: {traceback.format_exc()}")
+                logger.exception("Ошибка при обновлении клавиатуры: %s", markup_error)
             
     except Exception as e:
-        logger.error(f"Ошибка в check_subscription_callback: {e}")
-        logger.error(f"Полный traceback: {traceback.format_exc()}")
+        logger.exception("Ошибка в check_subscription_callback: %s", e)
         # В случае ошибки отправляем уведомление пользователю и даем доступ к боту
         try:
             user_id = call.from_user.id
-            if user_id not in ALLOWED_USERS:
-                ALLOWED_USERS.append(user_id)
+            ALLOWED_USERS.add(user_id)
             
             bot.answer_callback_query(call.id, "Произошла ошибка при проверке подписки, но мы предоставили доступ.")
             
             # Создаем соответствующую клавиатуру
-            markup = create_admin_markup() if user_id == ADMIN_ID else create_user_markup()
+            markup = ADMIN_MARKUP if user_id == ADMIN_ID else USER_MARKUP
             
             # Отправляем новое сообщение
             bot.send_message(
                 call.message.chat.id,
                 "⚠️ <b>Внимание!</b>\n\nПроизошла ошибка при проверке подписки, но мы предоставили вам доступ.\n"
                 "Пожалуйста, подпишитесь на наш канал @Simpatia_Liven57, если вы ещё этого не сделали.",
-                parse_mode="HTML",
                 reply_markup=markup
             )
         except:
             pass
 
 # Обработчик кнопок админ-панели
-@bot.callback_query_handler(func=lambda call: call.data.startswith('admin_'))
 def handle_admin_buttons(call):
     try:
         user_id = call.from_user.id
-        logger.info(f"Обработка кнопки админ-панели: {call.data} от пользователя {user_id}")
+        logger.info("Обработка кнопки админ-панели: %s от пользователя %s", call.data, user_id)
         
         if user_id != ADMIN_ID:
             bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
@@ -1398,28 +2140,29 @@ def handle_admin_buttons(call):
             
         # Проверяем, что call.message не None
         if not call.message:
-            logger.error(f"call.message is None при обработке {call.data}")
+            logger.error("call.message is None при обработке %s", call.data)
             bot.answer_callback_query(call.id, "Ошибка: сообщение не найдено")
             return
             
         # Проверяем данные колбэка
         if call.data == "admin_suggestions":
-            show_suggestions(call.message)
+            _LISTING_EXECUTOR.submit(show_suggestions, call.message)
         elif call.data == "admin_delete":
-            show_participants_for_deletion(call.message)
+            _LISTING_EXECUTOR.submit(show_participants_for_deletion, call.message)
         elif call.data == "admin_stats":
             show_statistics(call.message)
         elif call.data == "admin_tournament_settings":
             show_tournament_settings(call.message)
         elif call.data == "admin_view_all":
-            show_all_participants(call.message)
+            _LISTING_EXECUTOR.submit(show_all_participants, call.message)
         elif call.data == "admin_export":
-            export_database(call.message)
+            bot.send_message(call.message.chat.id, "⏳ Готовим отчет...")
+            _LISTING_EXECUTOR.submit(export_database, call.message)
         elif call.data == "admin_restart":
             confirm_restart_bot(call.message)
         elif call.data == "admin_back_to_main":
             # Возвращаем пользователя в основное меню
-            markup = create_admin_markup() if user_id == ADMIN_ID else create_user_markup()
+            markup = ADMIN_MARKUP if user_id == ADMIN_ID else USER_MARKUP
             bot.send_message(
                 call.message.chat.id,
                 "Вы вернулись в основное меню",
@@ -1428,15 +2171,17 @@ def handle_admin_buttons(call):
         elif call.data.startswith('admin_header'):
             # Заголовки не обрабатываем
             bot.answer_callback_query(call.id, "Это заголовок раздела")
+            return
         else:
-            logger.warning(f"Неизвестная команда админ-панели: {call.data}")
+            logger.warning("Неизвестная команда админ-панели: %s", call.data)
             bot.answer_callback_query(call.id, "Неизвестная команда")
+            return
             
         # Отвечаем на callback query, чтобы убрать часы загрузки
         bot.answer_callback_query(call.id)
             
     except Exception as e:
-        logger.error(f"Ошибка в handle_admin_buttons: {e}", exc_info=True)
+        logger.exception("Ошибка в handle_admin_buttons: %s", e)
         try:
             bot.answer_callback_query(call.id, "Произошла ошибка при обработке команды")
         except:
@@ -1444,20 +2189,9 @@ def handle_admin_buttons(call):
 
 # Функция для отображения всех участниц
 def show_all_participants(message):
-    conn = None
     try:
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
-        # Получаем всех одобренных участниц
-        c.execute("""
-            SELECT id, name, file_id, media_type, votes
-            FROM photos
-            WHERE approved = 1
-            ORDER BY votes DESC
-        """)
-        
-        participants = c.fetchall()
+        # Получаем всех одобренных участниц по убыванию голосов
+        participants = get_ranked_participants()
         
         if not participants:
             bot.send_message(message.chat.id, "📭 Нет участниц в турнире")
@@ -1466,131 +2200,108 @@ def show_all_participants(message):
         # Отправляем сообщение с количеством участниц
         bot.send_message(message.chat.id, f"📊 Всего участниц: {len(participants)}")
         
-        # Отправляем каждую участницу с информацией
+        # Готовим подписи и медиа участниц
+        entries = []
+        for participant in participants:
+            part_id = participant['id']
+            file_id, media_type = unpack_file_ref(participant['file_ref'])
+            
+            if not file_id:
+                logger.error("Пустой file_id для участницы #%s", part_id)
+                continue
+            
+            caption = f"👤 ID: {part_id}\n👤 Имя: {participant['name']}\n📊 Голосов: {participant['votes']}"
+            entries.append((part_id, file_id, media_type, caption))
+        
+        # Отправляем участниц альбомами; одиночную или отклоненную альбомом - по одной
         sent_count = 0
-        for participant in participants:
-            try:
-                if len(participant) < 5:
-                    logger.error(f"Неверный формат данных участницы: {participant}")
-                    continue
-                    
-                part_id, name, file_id, media_type, votes = participant
-                
-                if not file_id:
-                    logger.error(f"Пустой file_id для участницы #{part_id}")
-                    continue
-                
-                caption = f"👤 ID: {part_id}\n👤 Имя: {name}\n📊 Голосов: {votes}"
-                
+        for i in range(0, len(entries), MEDIA_GROUP_LIMIT):
+            chunk = entries[i:i + MEDIA_GROUP_LIMIT]
+            if len(chunk) > 1:
                 try:
-                    if media_type == 'photo':
-                        bot.send_photo(message.chat.id, file_id, caption=caption)
-                    else:
-                        bot.send_video(message.chat.id, file_id, caption=caption)
-                        
-                    sent_count += 1
-                    # Добавляем небольшую задержку, чтобы не превысить лимиты API
-                    time.sleep(0.1)
-                except telebot.apihelper.ApiException as api_err:
-                    logger.error(f"Ошибка API при отправке участницы #{part_id}: {api_err}")
+                    throttle_send(message.chat.id, len(chunk))
+                    send_with_retry(
+                        bot.send_media_group,
+                        message.chat.id,
+                        [input_media(file_id, media_type, caption) for _, file_id, media_type, caption in chunk]
+                    )
+                    sent_count += len(chunk)
                     continue
-                
-            except Exception as e:
-                logger.error(f"Ошибка при отправке участницы: {e}")
-                continue
+                except telebot.apihelper.ApiException as api_err:
+                    logger.error("Ошибка API при отправке альбома участниц: %s", api_err)
+                    
+            sent_count += send_media_items(
+                message.chat.id,
+                [(file_id, media_type, caption, None) for _, file_id, media_type, caption in chunk]
+            )
                 
         if sent_count == 0 and participants:
             bot.reply_to(message, "❌ Не удалось отобразить участниц. Попробуйте позже.")
         
         # Добавляем кнопку возврата в админ-панель
-        markup = types.InlineKeyboardMarkup()
-        back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
-        markup.add(back_btn)
+        markup = BACK_TO_ADMIN_MARKUP
         bot.send_message(message.chat.id, "Используйте кнопку ниже для возврата в админ-панель:", reply_markup=markup)
                 
     except Exception as e:
-        logger.error(f"Ошибка в show_all_participants: {e}", exc_info=True)
+        logger.exception("Ошибка в show_all_participants: %s", e)
         bot.reply_to(message, "Произошла ошибка при показе участниц")
-    finally:
-        if conn:
-            conn.close()
 
 # Функция для экспорта данных из базы
 def export_database(message):
-    conn = None
     try:
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
-        # Создаем временный файл с отчетом
-        report_file = "report.txt"
-        with open(report_file, "w", encoding="utf-8") as f:
-            # Заголовок отчета
-            f.write("===== ОТЧЕТ ПО БАЗЕ ДАННЫХ ТУРНИРА =====\n\n")
-            
-            # Участницы
+        with get_conn() as conn:
+            c = conn.cursor()
             c.execute("SELECT id, name, votes FROM photos WHERE approved = 1 ORDER BY votes DESC")
             participants = c.fetchall()
-            f.write(f"УЧАСТНИЦЫ ({len(participants)}):\n")
-            f.write("-" * 40 + "\n")
-            for p in participants:
-                f.write(f"ID: {p[0]}, Имя: {p[1]}, Голосов: {p[2]}\n")
-            f.write("\n")
-            
-            # Голоса
-            c.execute("SELECT COUNT(*) FROM user_votes")
-            votes_count = c.fetchone()[0]
-            c.execute("SELECT COUNT(DISTINCT user_id) FROM user_votes")
-            voters_count = c.fetchone()[0]
-            f.write(f"ГОЛОСА:\n")
-            f.write("-" * 40 + "\n")
-            f.write(f"Всего голосов: {votes_count}\n")
-            f.write(f"Уникальных голосующих: {voters_count}\n\n")
-            
-            # Настройки турнира
+            c.execute("SELECT COUNT(*), COUNT(DISTINCT user_id) FROM user_votes")
+            votes_count, voters_count = c.fetchone()
             c.execute("SELECT required_votes, tournament_duration, is_active, current_tournament_start FROM tournament_settings ORDER BY id DESC LIMIT 1")
             settings = c.fetchone()
-            if settings:
-                f.write(f"НАСТРОЙКИ ТУРНИРА:\n")
-                f.write("-" * 40 + "\n")
-                f.write(f"Необходимо голосов: {settings[0]}\n")
-                f.write(f"Длительность (часов): {settings[1]}\n")
-                f.write(f"Активен: {'Да' if settings[2] else 'Нет'}\n")
-                f.write(f"Дата начала: {settings[3]}\n\n")
-            
-            # Отчет сгенерирован
-            f.write(f"Отчет сгенерирован: {time.strftime('%Y-%m-%d %H:%M:%S')}")
-        
-        # Отправляем файл
-        with open(report_file, "rb") as f:
-            bot.send_document(message.chat.id, f, caption="📊 Экспорт данных из базы")
-            
-        # Удаляем временный файл
-        try:
-            os.remove(report_file)
-        except:
-            pass
+        
+        # Собираем отчет в памяти
+        lines = ["===== ОТЧЕТ ПО БАЗЕ ДАННЫХ ТУРНИРА =====\n\n"]
+        
+        # Участницы
+        lines.append(f"УЧАСТНИЦЫ ({len(participants)}):\n")
+        lines.append("-" * 40 + "\n")
+        lines.extend(f"ID: {p[0]}, Имя: {p[1]}, Голосов: {p[2]}\n" for p in participants)
+        lines.append("\n")
+        
+        # Голоса
+        lines.append("ГОЛОСА:\n")
+        lines.append("-" * 40 + "\n")
+        lines.append(f"Всего голосов: {votes_count}\n")
+        lines.append(f"Уникальных голосующих: {voters_count}\n\n")
+        
+        # Настройки турнира
+        if settings:
+            lines.append("НАСТРОЙКИ ТУРНИРА:\n")
+            lines.append("-" * 40 + "\n")
+            lines.append(f"Необходимо голосов: {settings[0]}\n")
+            lines.append(f"Длительность (часов): {settings[1]}\n")
+            lines.append(f"Активен: {'Да' if settings[2] else 'Нет'}\n")
+            lines.append(f"Дата начала: {settings[3]}\n\n")
+        
+        # Отчет сгенерирован
+        lines.append(f"Отчет сгенерирован: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+        
+        # Отправляем отчет из памяти, без временного файла на диске
+        report = io.BytesIO("".join(lines).encode("utf-8"))
+        report.name = "report.txt"
+        bot.send_document(message.chat.id, report, caption="📊 Экспорт данных из базы")
             
         # Добавляем кнопку возврата в админ-панель
-        markup = types.InlineKeyboardMarkup()
-        back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
-        markup.add(back_btn)
+        markup = BACK_TO_ADMIN_MARKUP
         bot.send_message(message.chat.id, "Используйте кнопку ниже для возврата в админ-панель:", reply_markup=markup)
             
     except Exception as e:
-        logger.error(f"Ошибка в export_database: {e}", exc_info=True)
+        logger.exception("Ошибка в export_database: %s", e)
         bot.reply_to(message, "Произошла ошибка при экспорте данных")
-    finally:
-        if conn:
-            conn.close()
 
 # Функция для подтверждения перезапуска бота
 def confirm_restart_bot(message):
     try:
-        markup = types.InlineKeyboardMarkup()
-        yes_btn = types.InlineKeyboardButton("✅ Да, перезапустить", callback_data="confirm_restart_yes")
-        no_btn = types.InlineKeyboardButton("❌ Нет, отмена", callback_data="admin_back_to_admin")
-        markup.row(yes_btn, no_btn)
+        markup = RESTART_CONFIRM_MARKUP
         
         bot.send_message(
             message.chat.id,
@@ -1599,11 +2310,10 @@ def confirm_restart_bot(message):
             reply_markup=markup
         )
     except Exception as e:
-        logger.error(f"Ошибка в confirm_restart_bot: {e}", exc_info=True)
+        logger.exception("Ошибка в confirm_restart_bot: %s", e)
         bot.reply_to(message, "Произошла ошибка при отображении подтверждения")
 
 # Обработчик кнопки возврата в админ-панель
-@bot.callback_query_handler(func=lambda call: call.data == "admin_back_to_admin")
 def handle_back_to_admin(call):
     try:
         if call.from_user.id != ADMIN_ID:
@@ -1617,11 +2327,10 @@ def handle_back_to_admin(call):
         bot.answer_callback_query(call.id)
         
     except Exception as e:
-        logger.error(f"Ошибка в handle_back_to_admin: {e}", exc_info=True)
+        logger.exception("Ошибка в handle_back_to_admin: %s", e)
         bot.answer_callback_query(call.id, "Произошла ошибка")
 
 # Обработчик подтверждения перезапуска бота
-@bot.callback_query_handler(func=lambda call: call.data == "confirm_restart_yes")
 def handle_restart_bot(call):
     try:
         if call.from_user.id != ADMIN_ID:
@@ -1631,7 +2340,7 @@ def handle_restart_bot(call):
         bot.send_message(call.message.chat.id, "🔄 Перезапуск бота...")
         
         # Логируем перезапуск
-        logger.info(f"Перезапуск бота по команде администратора")
+        logger.info("Перезапуск бота по команде администратора")
         
         # Выполняем безопасную остановку
         cleanup()
@@ -1644,40 +2353,50 @@ def handle_restart_bot(call):
         os.execl(python, python, "restart_bot.py")
         
     except Exception as e:
-        logger.error(f"Ошибка в handle_restart_bot: {e}", exc_info=True)
+        logger.exception("Ошибка в handle_restart_bot: %s", e)
         bot.answer_callback_query(call.id, "Произошла ошибка при перезапуске")
 
-# Механизм предотвращения запуска нескольких экземпляров бота
+# Механизм предотвращения запуска нескольких экземпляров бота: блокировка файла
+# снимается ядром при завершении процесса, в том числе аварийном
+LOCK_FILE = os.environ.get('BOT_LOCK_FILE', 'facemash.lock')
+_instance_lock_fd = None
+
+def _try_lock(fd):
+    """Пытается без ожидания захватить исключительную блокировку файла"""
+    try:
+        import fcntl
+    except ImportError:
+        # Windows
+        import msvcrt
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
 def is_bot_already_running():
     """Проверяет, запущен ли уже бот"""
-    global socket_instance
+    global _instance_lock_fd
+    if _instance_lock_fd is not None:
+        # Блокировку уже держит этот процесс
+        return False, _instance_lock_fd
+    fd = os.open(LOCK_FILE, os.O_CREAT | os.O_RDWR)
     try:
-        # Пытаемся создать сокет на локальном порту
-        bot_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # Устанавливаем параметр переиспользования адреса
-        bot_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        bot_socket.bind(('localhost', 45678))
-        bot_socket.listen(1)
-        
-        # Регистрируем функцию закрытия сокета при завершении
-        def cleanup():
-            try:
-                bot_socket.close()
-                logger.info("Сокет успешно закрыт при завершении")
-            except Exception as e:
-                logger.error(f"Ошибка при закрытии сокета: {e}")
-        
-        atexit.register(cleanup)
-        socket_instance = bot_socket
-        
-        logger.info("Сокет успешно создан. Бот запущен как единственный экземпляр.")
-        return False, bot_socket
-    except socket.error as e:
-        logger.error(f"Невозможно создать сокет, вероятно бот уже запущен: {e}")
+        _try_lock(fd)
+    except OSError as e:
+        os.close(fd)
+        logger.error("Файл блокировки %s занят, вероятно бот уже запущен: %s", LOCK_FILE, e)
         return True, None
+    
+    # Записываем PID для диагностики
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    atexit.register(os.close, fd)
+    _instance_lock_fd = fd
+    
+    logger.info("Блокировка %s получена. Бот запущен как единственный экземпляр.", LOCK_FILE)
+    return False, fd
 
 # Проверяем, запущен ли уже бот
-is_running, socket_instance = is_bot_already_running()
+is_running, _ = is_bot_already_running()
 if is_running:
     logger.error("Бот уже запущен! Завершение работы...")
     print("ОШИБКА: Бот уже запущен в другом процессе!")
@@ -1686,17 +2405,24 @@ if is_running:
 
 # Инициализация базы данных при запуске
 init_db()
+fill_db_pool()
+
+# Запускаем периодическую очистку заброшенных сессий
+schedule_session_sweep()
 
-# Добавляем обработчик ошибок Telegram API
-@bot.middleware_handler(update_types=['message', 'callback_query', 'inline_query'])
-def global_error_handler(bot_instance, update):
+# Запускаем фоновую отправку уведомлений администратору
+start_admin_notifier()
+
+# Один раз на обновление проверяем подписку и читаем состояние пользователя,
+# фильтры и обработчики дальше берут готовые атрибуты
+@bot.middleware_handler(update_types=['message', 'callback_query'])
+def annotate_update(bot_instance, update):
     try:
-        # Пропускаем обработку, это middleware
-        pass
+        user_id = update.from_user.id
+        update.subscription_ok = check_subscription(user_id) if SUBSCRIPTION_ENFORCED else True
+        update.user_state = get_user_state(user_id)
     except Exception as e:
-        logger.error(f"Неперехваченная ошибка в middleware: {e}", exc_info=True)
-        # Не позволяем ошибке остановить бота
-        return True
+        logger.exception("Неперехваченная ошибка в middleware: %s", e)
 
 # Переопределяем метод обработки исключений
 old_process_new_updates = bot.process_new_updates
@@ -1705,10 +2431,10 @@ def safe_process_new_updates(updates):
     try:
         old_process_new_updates(updates)
     except Exception as e:
-        logger.error(f"Критическая ошибка при обработке обновлений: {e}", exc_info=True)
+        logger.exception("Критическая ошибка при обработке обновлений: %s", e)
         # Отправляем уведомление администратору о критической ошибке
         try:
-            bot.send_message(ADMIN_ID, f"⚠️ Критическая ошибка в боте:\n{str(e)[:200]}...")
+            bot.send_message(ADMIN_ID, f"⚠️ Критическая ошибка в боте:\n{html.escape(str(e)[:200])}...")
         except:
             pass
 
@@ -1719,7 +2445,7 @@ def safe_send_message(chat_id, text, **kwargs):
     try:
         return bot.send_message(chat_id, text, **kwargs)
     except telebot.apihelper.ApiException as e:
-        logger.error(f"Ошибка API при отправке сообщения: {e}")
+        logger.error("Ошибка API при отправке сообщения: %s", e)
         # Пробуем отправить сообщение без особых параметров
         try:
             return bot.send_message(chat_id, text)
@@ -1727,253 +2453,150 @@ def safe_send_message(chat_id, text, **kwargs):
             logger.error("Не удалось отправить сообщение даже в базовом формате")
             return None
     except Exception as e:
-        logger.error(f"Неизвестная ошибка при отправке сообщения: {e}")
+        logger.error("Неизвестная ошибка при отправке сообщения: %s", e)
         return None
 
 # Функция для отображения предложенных участниц
 def show_suggestions(message):
-    conn = None
     try:
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
         # Получаем все ожидающие предложения
-        c.execute("""
-            SELECT id, name, file_id, media_type, suggested_by
-            FROM suggestions
-            WHERE status = 'pending'
-            ORDER BY created_at DESC
-        """)
-        
-        suggestions = c.fetchall()
+        with get_conn() as conn:
+            suggestions = conn.execute("""
+                SELECT id, name, file_ref, suggested_by
+                FROM suggestions
+                WHERE status = 'pending'
+                ORDER BY created_at DESC
+            """).fetchall()
         
         if not suggestions:
             bot.send_message(message.chat.id, "📭 Нет новых предложений")
             
             # Добавляем кнопку возврата в админ-панель
-            markup = types.InlineKeyboardMarkup()
-            back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
-            markup.add(back_btn)
+            markup = BACK_TO_ADMIN_MARKUP
             bot.send_message(message.chat.id, "Используйте кнопку ниже для возврата в админ-панель:", reply_markup=markup)
             return
             
-        # Отправляем каждое предложение с кнопками принять/отклонить
-        sent_count = 0
+        # Готовим предложения с кнопками принять/отклонить
+        items = []
+        item_ids = []
         for suggestion in suggestions:
-            try:
-                if len(suggestion) < 5:
-                    logger.error(f"Неверный формат данных предложения: {suggestion}")
-                    continue
-                    
-                suggestion_id, name, file_id, media_type, suggested_by = suggestion
-                
-                if not file_id:
-                    logger.error(f"Пустой file_id для предложения #{suggestion_id}")
-                    continue
-                
-                markup = types.InlineKeyboardMarkup(row_width=2)
-                accept_btn = types.InlineKeyboardButton("✅ Принять", callback_data=f"accept_suggestion_{suggestion_id}")
-                reject_btn = types.InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_suggestion_{suggestion_id}")
-                markup.add(accept_btn, reject_btn)
-                
-                caption = f"📝 Предложение #{suggestion_id}\n\n👤 Имя: {name}\n👤 От пользователя: {suggested_by}"
-                
-                try:
-                    if media_type == 'photo':
-                        bot.send_photo(message.chat.id, file_id, caption=caption, reply_markup=markup)
-                    else:
-                        bot.send_video(message.chat.id, file_id, caption=caption, reply_markup=markup)
-                        
-                    sent_count += 1
-                    # Добавляем небольшую задержку, чтобы не превысить лимиты API
-                    time.sleep(0.1)
-                except telebot.apihelper.ApiException as api_err:
-                    logger.error(f"Ошибка API при отправке предложения #{suggestion_id}: {api_err}")
-                    continue
-                
-            except Exception as e:
-                logger.error(f"Ошибка при отправке предложения: {e}")
+            suggestion_id = suggestion['id']
+            file_id, media_type = unpack_file_ref(suggestion['file_ref'])
+            
+            if not file_id:
+                logger.error("Пустой file_id для предложения #%s", suggestion_id)
                 continue
+            
+            markup = suggestion_decision_markup(suggestion_id)
+            caption = (f"📝 Предложение #{suggestion_id}\n\n👤 Имя: {suggestion['name']}\n"
+                       f"👤 От пользователя: {suggestion['suggested_by']}")
+            items.append((file_id, media_type, caption, markup))
+            item_ids.append(suggestion_id)
+        
+        sent = send_media_items_each(message.chat.id, items)
+        sent_ids = [suggestion_id for suggestion_id, ok in zip(item_ids, sent) if ok]
+        sent_count = len(sent_ids)
                 
         if sent_count == 0 and suggestions:
             bot.reply_to(message, "❌ Не удалось отобразить предложения. Попробуйте позже.")
         elif sent_count > 0:
-            # Добавляем кнопку возврата в админ-панель
-            markup = types.InlineKeyboardMarkup()
-            back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
-            markup.add(back_btn)
-            bot.send_message(message.chat.id, f"📬 Показано предложений: {sent_count}\n\nИспользуйте кнопку ниже для возврата в админ-панель:", reply_markup=markup)
+            # Кнопки массового принятия и возврата в админ-панель
+            markup = accept_all_suggestions_markup(remember_shown_suggestions(sent_ids))
+            bot.send_message(message.chat.id, f"📬 Показано предложений: {sent_count}\n\nПримите все разом или вернитесь в админ-панель:", reply_markup=markup)
             
     except sqlite3.Error as db_err:
-        logger.error(f"Ошибка базы данных в show_suggestions: {db_err}")
+        logger.error("Ошибка базы данных в show_suggestions: %s", db_err)
         bot.reply_to(message, "Произошла ошибка при доступе к базе данных")
     except Exception as e:
-        logger.error(f"Ошибка в show_suggestions: {e}", exc_info=True)
+        logger.exception("Ошибка в show_suggestions: %s", e)
         bot.reply_to(message, "Произошла ошибка при показе предложений")
-    finally:
-        if conn:
-            conn.close()
 
 # Функция для показа участниц для удаления
 def show_participants_for_deletion(message):
-    conn = None
     try:
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
         # Получаем всех одобренных участниц
-        c.execute("""
-            SELECT id, name, file_id, media_type, votes
-            FROM photos
-            WHERE approved = 1
-            ORDER BY name
-        """)
-        
-        participants = c.fetchall()
+        with get_conn() as conn:
+            participants = conn.execute("""
+                SELECT id, name, file_ref, votes
+                FROM photos
+                WHERE approved = 1
+                ORDER BY name
+            """).fetchall()
         
         if not participants:
             bot.send_message(message.chat.id, "📭 Нет участниц в турнире")
             
             # Добавляем кнопку возврата в админ-панель
-            markup = types.InlineKeyboardMarkup()
-            back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
-            markup.add(back_btn)
+            markup = BACK_TO_ADMIN_MARKUP
             bot.send_message(message.chat.id, "Используйте кнопку ниже для возврата в админ-панель:", reply_markup=markup)
             return
             
         # Отправляем сообщение с количеством участниц
         bot.send_message(message.chat.id, f"📊 Всего участниц для удаления: {len(participants)}")
         
-        # Отправляем каждую участницу с кнопкой удаления
-        sent_count = 0
+        # Готовим участниц с кнопкой удаления
+        items = []
         for participant in participants:
-            try:
-                if len(participant) < 5:
-                    logger.error(f"Неверный формат данных участницы: {participant}")
-                    continue
-                    
-                part_id, name, file_id, media_type, votes = participant
-                
-                if not file_id:
-                    logger.error(f"Пустой file_id для участницы #{part_id}")
-                    continue
-                
-                markup = types.InlineKeyboardMarkup()
-                delete_btn = types.InlineKeyboardButton("🗑 Удалить", callback_data=f"delete_participant_{part_id}")
-                markup.add(delete_btn)
-                
-                caption = f"👤 ID: {part_id}\n👤 Имя: {name}\n📊 Голосов: {votes}"
-                
-                try:
-                    if media_type == 'photo':
-                        bot.send_photo(message.chat.id, file_id, caption=caption, reply_markup=markup)
-                    else:
-                        bot.send_video(message.chat.id, file_id, caption=caption, reply_markup=markup)
-                        
-                    sent_count += 1
-                    # Добавляем небольшую задержку, чтобы не превысить лимиты API
-                    time.sleep(0.1)
-                except telebot.apihelper.ApiException as api_err:
-                    logger.error(f"Ошибка API при отправке участницы #{part_id}: {api_err}")
-                    continue
-                
-            except Exception as e:
-                logger.error(f"Ошибка при отправке участницы: {e}")
+            part_id = participant['id']
+            file_id, media_type = unpack_file_ref(participant['file_ref'])
+            
+            if not file_id:
+                logger.error("Пустой file_id для участницы #%s", part_id)
                 continue
+            
+            markup = types.InlineKeyboardMarkup()
+            delete_btn = types.InlineKeyboardButton("🗑 Удалить", callback_data=f"delete_participant_{part_id}")
+            markup.add(delete_btn)
+            
+            caption = f"👤 ID: {part_id}\n👤 Имя: {participant['name']}\n📊 Голосов: {participant['votes']}"
+            items.append((file_id, media_type, caption, markup))
+        
+        sent_count = send_media_items(message.chat.id, items)
                 
         if sent_count == 0 and participants:
             bot.reply_to(message, "❌ Не удалось отобразить участниц. Попробуйте позже.")
         
         # Добавляем кнопку возврата в админ-панель
-        markup = types.InlineKeyboardMarkup()
-        back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
-        markup.add(back_btn)
+        markup = BACK_TO_ADMIN_MARKUP
         bot.send_message(message.chat.id, "Используйте кнопку ниже для возврата в админ-панель:", reply_markup=markup)
                 
     except Exception as e:
-        logger.error(f"Ошибка в show_participants_for_deletion: {e}", exc_info=True)
+        logger.exception("Ошибка в show_participants_for_deletion: %s", e)
         bot.reply_to(message, "Произошла ошибка при показе участниц")
-    finally:
-        if conn:
-            conn.close()
 
 # Функция для показа статистики
 def show_statistics(message):
     try:
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
-        # Получаем статистику
-        c.execute("SELECT COUNT(*) FROM photos WHERE approved = 1")
-        total_participants = c.fetchone()[0]
-        
-        c.execute("SELECT COUNT(*) FROM suggestions WHERE status = 'pending'")
-        pending_suggestions = c.fetchone()[0]
-        
-        c.execute("SELECT COUNT(*) FROM user_votes")
-        total_votes = c.fetchone()[0]
-        
-        c.execute("SELECT COUNT(DISTINCT user_id) FROM user_votes")
-        unique_voters = c.fetchone()[0]
-        
-        # Получаем топ-3 участниц
-        c.execute("""
-            SELECT name, votes FROM photos 
-            WHERE approved = 1 
-            ORDER BY votes DESC 
-            LIMIT 3
-        """)
-        top_participants = c.fetchall()
-        
-        conn.close()
+        # Получаем статистику и топ-3 участниц
+        (total_participants, pending_suggestions, total_votes,
+         unique_voters, top_participants) = get_statistics()
         
         # Формируем сообщение со статистикой
-        stats = (f"📊 **Статистика турнира:**\n\n"
+        stats = (f"📊 <b>Статистика турнира:</b>\n\n"
                 f"👥 Участниц: {total_participants}\n"
                 f"📝 Ожидают одобрения: {pending_suggestions}\n"
                 f"🗳 Всего голосов: {total_votes}\n"
                 f"👤 Уникальных голосующих: {unique_voters}\n\n")
                 
         if top_participants:
-            stats += "🏆 **Топ участницы:**\n"
+            stats += "🏆 <b>Топ участницы:</b>\n"
             for i, (name, votes) in enumerate(top_participants, 1):
                 stats += f"{i}. {name} - {votes} голосов\n"
         
         # Создаем кнопку возврата
-        markup = types.InlineKeyboardMarkup()
-        back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
-        markup.add(back_btn)
+        markup = BACK_TO_ADMIN_MARKUP
         
-        bot.send_message(message.chat.id, stats, parse_mode="Markdown", reply_markup=markup)
+        bot.send_message(message.chat.id, stats, reply_markup=markup)
         
     except Exception as e:
-        logger.error(f"Ошибка в show_statistics: {e}")
+        logger.error("Ошибка в show_statistics: %s", e)
         bot.reply_to(message, "Произошла ошибка при показе статистики")
 
 # Функция для показа настроек турнира
 def show_tournament_settings(message):
     try:
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
-        # Получаем текущие настройки активного турнира
-        c.execute("""
-            SELECT required_votes, tournament_duration, is_active
-            FROM tournament_settings
-            WHERE is_active = 1
-        """)
-        
-        settings = c.fetchone()
-        
-        if not settings:
-            # Если нет активного турнира, получаем последние настройки
-            c.execute("""
-                SELECT required_votes, tournament_duration, is_active
-                FROM tournament_settings
-                ORDER BY id DESC
-                LIMIT 1
-            """)
-            settings = c.fetchone()
+        # Получаем настройки активного турнира, а если его нет - последние
+        settings = get_tournament_settings()
             
         if not settings:
             # Если нет никаких настроек, используем значения по умолчанию
@@ -1983,22 +2606,7 @@ def show_tournament_settings(message):
         else:
             required_votes, duration, is_active = settings
             
-        conn.close()
-            
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        votes_btn = types.InlineKeyboardButton("🗳 Изменить кол-во голосов", callback_data="set_votes")
-        time_btn = types.InlineKeyboardButton("⏱ Изменить длительность", callback_data="set_time")
-        
-        if is_active:
-            status_btn = types.InlineKeyboardButton("🛑 Остановить турнир", callback_data="stop_tournament")
-        else:
-            status_btn = types.InlineKeyboardButton("▶️ Запустить турнир", callback_data="start_tournament")
-        
-        back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
-            
-        markup.add(votes_btn, time_btn)
-        markup.add(status_btn)
-        markup.add(back_btn)
+        markup = TOURNAMENT_SETTINGS_MARKUPS[bool(is_active)]
         
         settings_text = (f"⚙️ Настройки турнира:\n\n"
                         f"🗳 Необходимо голосов: {required_votes}\n"
@@ -2008,13 +2616,11 @@ def show_tournament_settings(message):
         bot.send_message(message.chat.id, settings_text, reply_markup=markup)
         
     except Exception as e:
-        logger.error(f"Ошибка в show_tournament_settings: {e}")
+        logger.error("Ошибка в show_tournament_settings: %s", e)
         bot.reply_to(message, "Произошла ошибка при показе настроек турнира")
 
 # Восстанавливаем обработчик удаления участниц
-@bot.callback_query_handler(func=lambda call: call.data.startswith('delete_participant_'))
 def handle_participant_deletion(call):
-    conn = None
     try:
         user_id = call.from_user.id
         
@@ -2024,49 +2630,37 @@ def handle_participant_deletion(call):
             
         participant_id = int(call.data.split('_')[2])
         
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
-        # Получаем информацию об участнице перед удалением
-        c.execute("SELECT name FROM photos WHERE id = ?", (participant_id,))
-        participant = c.fetchone()
-        
+        # Удаляем участницу и связанные голоса одной транзакцией
+        with get_conn() as conn, write_transaction(conn):
+            participant = conn.execute(
+                "DELETE FROM photos WHERE id = ? RETURNING name", (participant_id,)
+            ).fetchone()
+            if participant:
+                conn.execute("DELETE FROM user_votes WHERE photo_id = ?", (participant_id,))
+                
         if not participant:
             bot.answer_callback_query(call.id, "Участница не найдена")
             return
             
         participant_name = participant[0]
-        
-        # Удаляем участницу и связанные голоса
-        c.execute("DELETE FROM user_votes WHERE photo_id = ?", (participant_id,))
-        c.execute("DELETE FROM photos WHERE id = ?", (participant_id,))
-        conn.commit()
+        invalidate_approved_ids()
+        invalidate_statistics()
+        _voted_cache.clear()
         
         # Пробуем удалить сообщение
-        try:
-            bot.delete_message(call.message.chat.id, call.message.message_id)
-        except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение при удалении участницы: {e}")
+        safe_delete_message(call.message.chat.id, call.message.message_id)
         
         bot.send_message(call.message.chat.id, f"✅ Участница {participant_name} успешно удалена!")
         bot.answer_callback_query(call.id, f"Участница удалена")
         
     except sqlite3.Error as e:
-        logger.error(f"Ошибка базы данных при удалении участницы: {e}")
+        logger.error("Ошибка базы данных при удалении участницы: %s", e)
         bot.answer_callback_query(call.id, "Ошибка при удалении участницы")
-        if conn:
-            conn.rollback()
     except Exception as e:
-        logger.error(f"Ошибка в handle_participant_deletion: {e}")
+        logger.error("Ошибка в handle_participant_deletion: %s", e)
         bot.answer_callback_query(call.id, "Произошла ошибка")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
 
 # Восстанавливаем обработчики настроек турнира
-@bot.callback_query_handler(func=lambda call: call.data in ['set_votes', 'set_time', 'start_tournament', 'stop_tournament'])
 def handle_tournament_settings(call):
     try:
         user_id = call.from_user.id
@@ -2075,6 +2669,11 @@ def handle_tournament_settings(call):
             bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
             return
             
+        # Настройки сохраняются только в активный турнир, поэтому без него не спрашиваем их
+        if call.data in ('set_votes', 'set_time') and get_active_tournament() is None:
+            bot.answer_callback_query(call.id, "🚫 Нет активного турнира: сначала запустите турнир")
+            return
+            
         if call.data == 'set_votes':
             set_user_state(user_id, UserStates.WAITING_VOTES_COUNT)
             bot.send_message(call.message.chat.id, "Введите необходимое количество голосов:")
@@ -2090,86 +2689,84 @@ def handle_tournament_settings(call):
             stop_tournament(call.message)
             
     except Exception as e:
-        logger.error(f"Ошибка в handle_tournament_settings: {e}")
+        logger.error("Ошибка в handle_tournament_settings: %s", e)
         bot.answer_callback_query(call.id, "Произошла ошибка")
 
 # Восстанавливаем функцию запуска турнира
 def start_new_tournament(message):
-    conn = None
     try:
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
-        # Проверяем, есть ли активный турнир
-        c.execute("SELECT id FROM tournament_settings WHERE is_active = 1")
-        if c.fetchone():
-            bot.reply_to(message, "🚫 Уже есть активный турнир")
-            return
+        with get_conn() as conn:
+            c = conn.cursor()
             
-        # Проверяем, есть ли участницы для турнира
-        c.execute("SELECT COUNT(*) FROM photos WHERE approved = 1")
-        participants_count = c.fetchone()[0]
-        
-        if participants_count < 2:
-            bot.reply_to(message, "❌ Для начала турнира необходимо минимум 2 участницы")
-            return
+            # Проверяем, есть ли активный турнир и участницы для него
+            c.execute("""
+                SELECT (SELECT id FROM tournament_settings WHERE is_active = 1 LIMIT 1),
+                       (SELECT COUNT(*) FROM photos WHERE approved = 1)
+            """)
+            active_id, participants_count = c.fetchone()
             
-        # Создаем новый турнир
-        c.execute("""
-            INSERT INTO tournament_settings (required_votes, tournament_duration, is_active, current_tournament_start)
-            VALUES (?, ?, 1, CURRENT_TIMESTAMP)
-        """, (15, 24))  # Устанавливаем 15 голосов по умолчанию
-        
-        conn.commit()
-        bot.reply_to(message, f"✅ Новый турнир запущен!\n👥 Участниц: {participants_count}\n🗳 Необходимо голосов для победы: 15")
+            if active_id is not None:
+                bot.reply_to(message, "🚫 Уже есть активный турнир")
+                return
+                
+            if participants_count < 2:
+                bot.reply_to(message, "❌ Для начала турнира необходимо минимум 2 участницы")
+                return
+                
+            # Создаем новый турнир с настройками последнего, а без него - по умолчанию
+            c.execute("""
+                INSERT INTO tournament_settings (required_votes, tournament_duration, is_active, current_tournament_start)
+                VALUES (
+                    COALESCE((SELECT required_votes FROM tournament_settings ORDER BY id DESC LIMIT 1), 15),
+                    COALESCE((SELECT tournament_duration FROM tournament_settings ORDER BY id DESC LIMIT 1), 24),
+                    1, CURRENT_TIMESTAMP
+                )
+                RETURNING required_votes
+            """)
+            required_votes = c.fetchone()[0]
+            
+            conn.commit()
+        invalidate_tournament_cache()
+        bot.reply_to(message, f"✅ Новый турнир запущен!\n👥 Участниц: {participants_count}\n🗳 Необходимо голосов для победы: {required_votes}")
         
         # Добавляем кнопку возврата в админ-панель
-        markup = types.InlineKeyboardMarkup()
-        back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
-        markup.add(back_btn)
+        markup = BACK_TO_ADMIN_MARKUP
         bot.send_message(message.chat.id, "Используйте кнопку ниже для возврата в админ-панель:", reply_markup=markup)
         
     except sqlite3.Error as e:
-        logger.error(f"Ошибка базы данных в start_new_tournament: {e}")
+        logger.error("Ошибка базы данных в start_new_tournament: %s", e)
         bot.reply_to(message, "Произошла ошибка при запуске турнира")
-        if conn:
-            conn.rollback()
     except Exception as e:
-        logger.error(f"Ошибка в start_new_tournament: {e}")
+        logger.error("Ошибка в start_new_tournament: %s", e)
         bot.reply_to(message, "Произошла ошибка при запуске турнира")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
 
 # Восстанавливаем функцию остановки турнира
 def stop_tournament(message):
-    conn = None
     try:
-        conn = sqlite3.connect('facemash.db')
-        c = conn.cursor()
-        
-        # Получаем информацию о турнире перед остановкой
-        c.execute("""
-            SELECT t.id, t.required_votes,
-                   (SELECT COUNT(*) FROM photos p WHERE p.approved = 1) as total_participants,
-                   (SELECT COUNT(*) FROM user_votes) as total_votes
-            FROM tournament_settings t
-            WHERE t.is_active = 1
-        """)
-        
-        tournament_info = c.fetchone()
-        
-        if not tournament_info:
-            bot.reply_to(message, "🚫 Нет активного турнира")
-            return
+        with get_conn() as conn:
+            c = conn.cursor()
             
-        tournament_id, required_votes, total_participants, total_votes = tournament_info
-        
-        # Останавливаем турнир
-        c.execute("UPDATE tournament_settings SET is_active = 0 WHERE id = ?", (tournament_id,))
-        conn.commit()
+            # Получаем информацию о турнире перед остановкой
+            c.execute("""
+                SELECT t.id, t.required_votes,
+                       (SELECT COUNT(*) FROM photos p WHERE p.approved = 1) as total_participants,
+                       (SELECT COUNT(*) FROM user_votes) as total_votes
+                FROM tournament_settings t
+                WHERE t.is_active = 1
+            """)
+            
+            tournament_info = c.fetchone()
+            
+            if not tournament_info:
+                bot.reply_to(message, "🚫 Нет активного турнира")
+                return
+                
+            tournament_id, required_votes, total_participants, total_votes = tournament_info
+            
+            # Останавливаем турнир
+            c.execute("UPDATE tournament_settings SET is_active = 0 WHERE id = ?", (tournament_id,))
+            conn.commit()
+        invalidate_tournament_cache()
         
         # Отправляем статистику турнира
         stats = (f"🏁 Турнир завершен!\n\n"
@@ -2181,24 +2778,15 @@ def stop_tournament(message):
         bot.reply_to(message, stats)
         
         # Добавляем кнопку возврата в админ-панель
-        markup = types.InlineKeyboardMarkup()
-        back_btn = types.InlineKeyboardButton("🔙 Вернуться в админ-панель", callback_data="admin_back_to_admin")
-        markup.add(back_btn)
+        markup = BACK_TO_ADMIN_MARKUP
         bot.send_message(message.chat.id, "Используйте кнопку ниже для возврата в админ-панель:", reply_markup=markup)
         
     except sqlite3.Error as e:
-        logger.error(f"Ошибка базы данных в stop_tournament: {e}")
+        logger.error("Ошибка базы данных в stop_tournament: %s", e)
         bot.reply_to(message, "Произошла ошибка при остановке турнира")
-        if conn:
-            conn.rollback()
     except Exception as e:
-        logger.error(f"Ошибка в stop_tournament: {e}")
+        logger.error("Ошибка в stop_tournament: %s", e)
         bot.reply_to(message, "Произошла ошибка при остановке турнира")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
 
 def handle_user_state(message):
     """Обрабатывает сообщения пользователя в зависимости от его текущего состояния"""
@@ -2206,99 +2794,114 @@ def handle_user_state(message):
         user_id = message.from_user.id
         current_state = get_user_state(user_id)
         
-        logger.info(f"Обработка сообщения в состоянии {current_state} от пользователя {user_id}")
+        logger.info("Обработка сообщения в состоянии %s от пользователя %s", current_state, user_id)
         
         if current_state == UserStates.WAITING_NAME:
             handle_name(message)
         elif current_state == UserStates.WAITING_VOTES_COUNT:
             # Обработка ввода количества голосов для турнира
-            try:
-                votes = int(message.text.strip())
-                if votes < 1 or votes > 1000:
-                    bot.send_message(message.chat.id, "Количество голосов должно быть от 1 до 1000.")
-                    return
-                    
-                user_data[user_id]['votes_count'] = votes
-                set_user_state(user_id, UserStates.WAITING_TOURNAMENT_TIME)
-                
-                bot.send_message(
-                    message.chat.id, 
-                    "Теперь введите продолжительность турнира в часах (от 1 до 168):"
-                )
-            except ValueError:
+            match = INT_INPUT_RE.match(message.text or '')
+            if not match:
                 bot.send_message(message.chat.id, "Пожалуйста, введите число.")
+                return
+            votes = int(match.group(1))
+            if votes < 1 or votes > 1000:
+                bot.send_message(message.chat.id, "Количество голосов должно быть от 1 до 1000.")
+                return
+                
+            sess = get_session(user_id)
+            sess.votes_count = votes
+            sess.state = UserStates.WAITING_TOURNAMENT_TIME
+            
+            bot.send_message(
+                message.chat.id, 
+                "Теперь введите продолжительность турнира в часах (от 1 до 168):"
+            )
         elif current_state == UserStates.WAITING_TOURNAMENT_TIME:
             # Обработка ввода продолжительности турнира
-            try:
-                hours = int(message.text.strip())
-                if hours < 1 or hours > 168:
-                    bot.send_message(message.chat.id, "Продолжительность должна быть от 1 до 168 часов.")
-                    return
-                    
-                # Сохраняем настройки турнира
-                conn = sqlite3.connect(DB_NAME)
-                cursor = conn.cursor()
-                
-                # Обновляем настройки турнира
-                cursor.execute(
-                    "UPDATE tournament_settings SET required_votes = ?, duration_hours = ? WHERE active = 1",
-                    (user_data[user_id]['votes_count'], hours)
-                )
-                conn.commit()
-                conn.close()
+            match = INT_INPUT_RE.match(message.text or '')
+            if not match:
+                bot.send_message(message.chat.id, "Пожалуйста, введите число.")
+                return
+            hours = int(match.group(1))
+            if hours < 1 or hours > 168:
+                bot.send_message(message.chat.id, "Продолжительность должна быть от 1 до 168 часов.")
+                return
                 
-                # Сбрасываем состояние
-                set_user_state(user_id, UserStates.START)
+            votes_count = get_session(user_id).votes_count
+            
+            # Обновляем настройки активного турнира одной явной транзакцией;
+            # без введенного ранее числа голосов оставляем текущее
+            with get_conn() as conn:
+                with write_transaction(conn):
+                    updated = conn.execute(SQL_UPDATE_TOURNAMENT_SETTINGS, (votes_count, hours)).rowcount
+            invalidate_tournament_cache()
+            
+            if not updated:
+                reset_session(user_id)
+                bot.send_message(message.chat.id, "🚫 Нет активного турнира: настройки не сохранены", reply_markup=ADMIN_MARKUP)
+                return
                 
-                bot.send_message(
-                    message.chat.id, 
-                    f"✅ Настройки турнира обновлены:\n"
-                    f"• Требуемое количество голосов: {user_data[user_id]['votes_count']}\n"
-                    f"• Продолжительность турнира: {hours} часов",
-                    reply_markup=create_admin_markup()
-                )
-            except ValueError:
-                bot.send_message(message.chat.id, "Пожалуйста, введите число.")
+            if votes_count is None:
+                votes_count = get_tournament_settings()[0]
+            
+            # Сбрасываем состояние
+            reset_session(user_id)
+            
+            bot.send_message(
+                message.chat.id, 
+                f"✅ Настройки турнира обновлены:\n"
+                f"• Требуемое количество голосов: {votes_count}\n"
+                f"• Продолжительность турнира: {hours} часов",
+                reply_markup=ADMIN_MARKUP
+            )
         else:
             # Неизвестное состояние
-            logger.warning(f"Неизвестное состояние пользователя: {current_state}")
+            logger.warning("Неизвестное состояние пользователя: %s", current_state)
             set_user_state(user_id, UserStates.START)
             bot.send_message(message.chat.id, "Используйте кнопки для навигации по боту.")
     except Exception as e:
-        logger.error(f"Ошибка в handle_user_state: {e}")
+        logger.error("Ошибка в handle_user_state: %s", e)
         bot.send_message(message.chat.id, "Произошла ошибка при обработке вашего сообщения.")
 
-# Дополнительный обработчик для старых кнопок (можно удалить позже)
-@bot.callback_query_handler(func=lambda call: call.data == "check_subscription")
-def check_subscription_callback(call):
-    """Простой обработчик для старых кнопок проверки подписки"""
-    user_id = call.from_user.id
-    
-    # Просто добавляем пользователя в список разрешенных
-    if user_id not in ALLOWED_USERS:
-        ALLOWED_USERS.append(user_id)
-    
-    # Создаем соответствующую клавиатуру
-    markup = create_admin_markup() if user_id == ADMIN_ID else create_user_markup()
-    
-    # Просто показываем меню
-    bot.send_message(
-        call.message.chat.id,
-        f"<b>Доступные команды:</b>\n"
-        f"🎭 <b>Начать голосование</b> - участвовать в текущем турнире\n"
-        f"🏆 <b>Топ участниц</b> - посмотреть рейтинг участниц\n"
-        f"➕ <b>Предложить участницу</b> - предложить новую участницу",
-        parse_mode="HTML",
-        reply_markup=markup
-    )
-    
-    bot.answer_callback_query(call.id, "Доступ предоставлен!")
+# Маршруты callback-кнопок: сначала точное значение, затем префикс до первого "_"
+CALLBACK_ROUTES = {
+    "edit_name": handle_preview_buttons,
+    "edit_media": handle_preview_buttons,
+    "send_proposal": handle_preview_buttons,
+    "cancel_proposal": handle_preview_buttons,
+    "check_subscription": check_subscription_callback,
+    "admin_back_to_admin": handle_back_to_admin,
+    "confirm_restart_yes": handle_restart_bot,
+    "set_votes": handle_tournament_settings,
+    "set_time": handle_tournament_settings,
+    "start_tournament": handle_tournament_settings,
+    "stop_tournament": handle_tournament_settings,
+}
+CALLBACK_PREFIX_ROUTES = {
+    "vote": handle_vote,
+    "admin": handle_admin_buttons,
+    "delete": handle_participant_deletion,
+    "acceptall": handle_accept_all_suggestions,
+}
+
+@bot.callback_query_handler(func=lambda call: True)
+def route_callback(call):
+    """Передает callback-запрос обработчику по данным кнопки"""
+    data = call.data or ''
+    handler = CALLBACK_ROUTES.get(data) or CALLBACK_PREFIX_ROUTES.get(data.partition('_')[0])
+    if handler is None and is_suggestion_callback(data):
+        handler = handle_suggestion_decision
+    if handler is None:
+        logger.warning("Неизвестный callback: %s", data)
+        # Ответ убирает часы загрузки на кнопке
+        bot.answer_callback_query(call.id)
+        return
+    handler(call)
 
 if __name__ == "__main__":
     try:
-        # Инициализируем БД
-        init_db()
-        
+        # БД уже инициализирована при импорте модуля
         # Главные настройки
         mode = os.environ.get('MODE', 'polling').lower()  # по умолчанию polling
         
@@ -2319,40 +2922,6 @@ if __name__ == "__main__":
         
         logger.info("Бот запущен")
         
-        # Инициализация keep-alive для Render, если мы в веб-режиме
-        if mode == 'webhook' and os.environ.get('RENDER_EXTERNAL_URL'):
-            try:
-                from keep_alive import start_keep_alive_thread
-                keep_alive_thread = start_keep_alive_thread()
-                logger.info("Запущен keep-alive сервис для Render")
-            except Exception as e:
-                logger.error(f"Ошибка при запуске keep-alive сервиса: {e}")
-                logger.error(traceback.format_exc())
-        
-        # Определяем режим запуска
-        if mode == 'webhook':
-            # Режим webhook - для запуска на сервере
-            
-            # Получаем параметры из переменных окружения
-            WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', '')
-            WEBHOOK_PORT = int(os.environ.get('PORT', 5000))
-            
-            # Для Render используем переменную окружения RENDER_EXTERNAL_URL
-            if os.environ.get('RENDER_EXTERNAL_URL'):
-                WEBHOOK_URL = os.environ.get('RENDER_EXTERNAL_URL') + WEBHOOK_PATH
-                logger.info(f"Используем URL Render: {WEBHOOK_URL}")
-            else:
-                WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
-            
-            # Настройка Flask
-            app = Flask(__name__)
-            logger.info(f"Бот запущен в режиме webhook на {WEBHOOK_URL}")
-            
-            # Удаляем старый вебхук и устанавливаем новый
-            bot.remove_webhook()
-            time.sleep(0.1)
-            bot.set_webhook(url=WEBHOOK_URL)
-        
         # Проверяем, запущен ли бот на хостинге
         IS_HEROKU = os.environ.get('DYNO') is not None
         IS_PYTHONANYWHERE = 'PYTHONANYWHERE_DOMAIN' in os.environ
@@ -2361,158 +2930,198 @@ if __name__ == "__main__":
         # Переменная окружения для определения режима (webhook/polling)
         USE_WEBHOOK = os.environ.get('USE_WEBHOOK', 'False').lower() in ('true', '1', 't')
         
+        # Режим запуска определяется один раз: webhook настраивается в единственном месте
+        use_webhook = mode == 'webhook' or USE_WEBHOOK or IS_HEROKU or IS_PYTHONANYWHERE or IS_RAILWAY
+        
+        # Инициализация keep-alive для Render, если мы в веб-режиме
+        if use_webhook and os.environ.get('RENDER_EXTERNAL_URL'):
+            try:
+                from keep_alive import start_keep_alive_thread
+                keep_alive_thread = start_keep_alive_thread()
+                logger.info("Запущен keep-alive сервис для Render")
+            except Exception as e:
+                logger.exception("Ошибка при запуске keep-alive сервиса: %s", e)
+        
         # Проверяем, нужно ли использовать webhook
-        if USE_WEBHOOK or IS_HEROKU or IS_PYTHONANYWHERE or IS_RAILWAY:
+        if use_webhook:
             # Режим webhook - для хостинга
-            import flask
+            # Flask нужен только в режиме webhook, polling-запуск его не загружает
             from flask import Flask, request
             
+            # Ответы мониторинга сериализуем через orjson, если он установлен
+            try:
+                import orjson
+            except ImportError:
+                import json
+                
+                def dumps_json(obj):
+                    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+            else:
+                dumps_json = orjson.dumps
+            
             app = Flask(__name__)
             
-            # URL для webhook должен соответствовать URL вашего приложения
-            WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', 'https://your-app-name.herokuapp.com')
+            # URL для webhook должен соответствовать URL вашего приложения;
+            # на Render используем переменную окружения RENDER_EXTERNAL_URL
             WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', f'/webhook/{bot.token}')
-            WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
+            if os.environ.get('RENDER_EXTERNAL_URL'):
+                WEBHOOK_URL = os.environ.get('RENDER_EXTERNAL_URL') + WEBHOOK_PATH
+                logger.info("Используем URL Render: %s", WEBHOOK_URL)
+            else:
+                WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', 'https://your-app-name.herokuapp.com')
+                WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
+            logger.info("Бот запущен в режиме webhook на %s", WEBHOOK_URL)
             
-            # Настройка webhook
+            # Удаляем старый вебхук и устанавливаем новый
             bot.remove_webhook()
             time.sleep(0.1)
-            bot.set_webhook(url=WEBHOOK_URL)
+            bot.set_webhook(url=WEBHOOK_URL, allowed_updates=['message', 'callback_query'])
             
             @app.route(WEBHOOK_PATH, methods=['POST'])
             def webhook():
                 if request.headers.get('content-type') == 'application/json':
-                    json_string = request.get_data().decode('utf-8')
-                    update = telebot.types.Update.de_json(json_string)
+                    # Тело разбирает Flask, de_json получает уже готовый словарь
+                    update = telebot.types.Update.de_json(request.get_json(cache=False))
                     bot.process_new_updates([update])
-                    return ''
+                    return '', 204
                 else:
                     return 'Ошибка: не JSON', 403
             
+            # Страница статуса собирается один раз при запуске, на запрос подставляется только время
+            RENDER_EXTERNAL_URL = os.environ.get('RENDER_EXTERNAL_URL', 'https://your-app.onrender.com')
+            INDEX_TEMPLATE = string.Template(string.Template("""
+            <!DOCTYPE html>
+            <html>
+            <head>
+                <title>Бот конкурса красоты</title>
+                <meta charset="UTF-8">
+                <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                <style>
+                    body {
+                        font-family: Arial, sans-serif;
+                        line-height: 1.6;
+                        margin: 0;
+                        padding: 20px;
+                        color: #333;
+                        max-width: 800px;
+                        margin: 0 auto;
+                    }
+                    h1 {
+                        color: #2c3e50;
+                        border-bottom: 2px solid #eee;
+                        padding-bottom: 10px;
+                    }
+                    .status {
+                        background-color: #e8f5e9;
+                        padding: 15px;
+                        border-radius: 5px;
+                        margin: 20px 0;
+                    }
+                    .routes {
+                        background-color: #f5f5f5;
+                        padding: 15px;
+                        border-radius: 5px;
+                    }
+                    code {
+                        background-color: #f8f8f8;
+                        padding: 2px 5px;
+                        border-radius: 3px;
+                        font-family: monospace;
+                    }
+                    ul {
+                        list-style-type: square;
+                    }
+                    .timestamp {
+                        font-size: 0.8em;
+                        color: #777;
+                    }
+                </style>
+            </head>
+            <body>
+                <h1>Бот конкурса красоты</h1>
+                
+                <div class="status">
+                    <h2>Статус бота</h2>
+                    <p>✅ <strong>Бот работает нормально!</strong></p>
+                    <p class="timestamp">Последнее обновление: $timestamp</p>
+                </div>
+                
+                <div class="routes">
+                    <h2>Endpoints для мониторинга</h2>
+                    <ul>
+                        <li><code>/ping</code> - Простая проверка активности (для UptimeRobot)</li>
+                        <li><code>/health</code> - Расширенная проверка состояния бота</li>
+                        <li><code>/status</code> - Статус механизма keep-alive</li>
+                    </ul>
+                </div>
+                
+                <h2>Инструкции по настройке UptimeRobot</h2>
+                <ol>
+                    <li>Зарегистрируйтесь на <a href="https://uptimerobot.com/" target="_blank">UptimeRobot</a></li>
+                    <li>Создайте новый монитор типа "HTTP(s)"</li>
+                    <li>В поле URL укажите: <code>$url/ping</code></li>
+                    <li>Установите интервал проверки: 5 минут</li>
+                    <li>Также рекомендуется создать второй монитор для <code>$url/health</code></li>
+                </ol>
+                
+                <p><small>Этот сервер настроен с расширенным механизмом keep-alive для работы на Render.</small></p>
+            </body>
+            </html>
+            """).safe_substitute(url=RENDER_EXTERNAL_URL))
+            
             @app.route('/')
             def index():
-                html = """
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Бот конкурса красоты</title>
-                    <meta charset="UTF-8">
-                    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                    <style>
-                        body {
-                            font-family: Arial, sans-serif;
-                            line-height: 1.6;
-                            margin: 0;
-                            padding: 20px;
-                            color: #333;
-                            max-width: 800px;
-                            margin: 0 auto;
-                        }
-                        h1 {
-                            color: #2c3e50;
-                            border-bottom: 2px solid #eee;
-                            padding-bottom: 10px;
-                        }
-                        .status {
-                            background-color: #e8f5e9;
-                            padding: 15px;
-                            border-radius: 5px;
-                            margin: 20px 0;
-                        }
-                        .routes {
-                            background-color: #f5f5f5;
-                            padding: 15px;
-                            border-radius: 5px;
-                        }
-                        code {
-                            background-color: #f8f8f8;
-                            padding: 2px 5px;
-                            border-radius: 3px;
-                            font-family: monospace;
-                        }
-                        ul {
-                            list-style-type: square;
-                        }
-                        .timestamp {
-                            font-size: 0.8em;
-                            color: #777;
-                        }
-                    </style>
-                </head>
-                <body>
-                    <h1>Бот конкурса красоты</h1>
-                    
-                    <div class="status">
-                        <h2>Статус бота</h2>
-                        <p>✅ <strong>Бот работает нормально!</strong></p>
-                        <p class="timestamp">Последнее обновление: %s</p>
-                    </div>
-                    
-                    <div class="routes">
-                        <h2>Endpoints для мониторинга</h2>
-                        <ul>
-                            <li><code>/ping</code> - Простая проверка активности (для UptimeRobot)</li>
-                            <li><code>/health</code> - Расширенная проверка состояния бота</li>
-                            <li><code>/status</code> - Статус механизма keep-alive</li>
-                        </ul>
-                    </div>
-                    
-                    <h2>Инструкции по настройке UptimeRobot</h2>
-                    <ol>
-                        <li>Зарегистрируйтесь на <a href="https://uptimerobot.com/" target="_blank">UptimeRobot</a></li>
-                        <li>Создайте новый монитор типа "HTTP(s)"</li>
-                        <li>В поле URL укажите: <code>%s/ping</code></li>
-                        <li>Установите интервал проверки: 5 минут</li>
-                        <li>Также рекомендуется создать второй монитор для <code>%s/health</code></li>
-                    </ol>
-                    
-                    <p><small>Этот сервер настроен с расширенным механизмом keep-alive для работы на Render.</small></p>
-                </body>
-                </html>
-                """ % (
-                    time.strftime("%Y-%m-%d %H:%M:%S"), 
-                    os.environ.get('RENDER_EXTERNAL_URL', 'https://your-app.onrender.com'),
-                    os.environ.get('RENDER_EXTERNAL_URL', 'https://your-app.onrender.com')
-                )
-                return html
+                return INDEX_TEMPLATE.substitute(timestamp=current_timestamp())
+            
+            # /ping опрашивается чаще всего, поэтому отвечает готовыми байтами в обход
+            # маршрутизации и контекста запроса Flask
+            PING_BODY = "Бот активен!".encode('utf-8')
+            PING_HEADERS = [('Content-Type', 'text/plain; charset=utf-8'), ('Content-Length', str(len(PING_BODY)))]
+            flask_wsgi_app = app.wsgi_app
             
-            @app.route('/ping')
-            def ping():
-                return "Бот активен!", 200
+            def ping_wsgi_app(environ, start_response):
+                if environ.get('PATH_INFO') != '/ping':
+                    return flask_wsgi_app(environ, start_response)
+                start_response('200 OK', PING_HEADERS)
+                return [] if environ.get('REQUEST_METHOD') == 'HEAD' else [PING_BODY]
+            
+            app.wsgi_app = ping_wsgi_app
                 
-            # Дополнительные маршруты для мониторинга
+            # Дополнительные маршруты для мониторинга.
+            # Число участниц берется из кэша статистики, который сбрасывается при
+            # добавлении и удалении участниц, поэтому частые пробы не сканируют таблицу.
+            # При ошибке сохраняется последнее успешно полученное число участниц
+            _health_state = {'photos_count': None}
+            
             @app.route('/health')
             def health_check():
                 # Проверяем базу данных
                 db_ok = False
                 try:
-                    conn = sqlite3.connect('facemash.db')
-                    c = conn.cursor()
-                    c.execute("SELECT COUNT(*) FROM photos")
-                    photos_count = c.fetchone()[0]
+                    _health_state['photos_count'] = get_photos_count()
                     db_ok = True
-                    conn.close()
                 except Exception as e:
-                    logger.error(f"Ошибка проверки БД: {e}")
+                    logger.error("Ошибка проверки БД: %s", e)
+                photos_count = _health_state['photos_count']
                 
                 # Формируем статус
                 status = {
                     "status": "ok" if db_ok else "error",
-                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "timestamp": current_timestamp(),
                     "bot_active": True,
                     "db_connected": db_ok
                 }
                 
-                if db_ok:
+                if photos_count is not None:
                     status["photos_count"] = photos_count
                 
                 # Отправляем ответ
-                return json.dumps(status, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+                return dumps_json(status), 200, {'Content-Type': 'application/json'}
                 
             @app.route('/status')
             def keep_alive_status():
                 # Если доступен keep_alive_thread, получаем его статус
-                status = {"active": True, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")}
+                status = {"active": True, "timestamp": current_timestamp()}
                 
                 if 'keep_alive_thread' in globals() and hasattr(keep_alive_thread, 'get_status'):
                     ka_status = keep_alive_thread.get_status()
@@ -2520,29 +3129,38 @@ if __name__ == "__main__":
                 else:
                     status["keep_alive"] = {"is_running": False, "message": "Keep-alive сервис не запущен или недоступен"}
                 
-                return json.dumps(status, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+                return dumps_json(status), 200, {'Content-Type': 'application/json'}
             
-            # Запуск Flask-сервера
+            # Запуск веб-сервера: production-сервер waitress, если установлен,
+            # иначе встроенный сервер Flask с потоком на запрос
             PORT = int(os.environ.get('PORT', 5000))
-            app.run(host='0.0.0.0', port=PORT)
+            try:
+                from waitress import serve
+            except ImportError:
+                logger.warning("waitress не установлен, используется встроенный сервер Flask")
+                app.run(host='0.0.0.0', port=PORT, threaded=True)
+            else:
+                serve(app, host='0.0.0.0', port=PORT, threads=BOT_WORKER_THREADS)
         else:
             # Режим polling - для локального запуска
             logger.info("Бот запущен в режиме polling")
             
             # Проверяем, запущен ли уже бот
-            already_running, socket_instance = is_bot_already_running()
+            already_running, _ = is_bot_already_running()
             if not already_running:
                 # Сбрасываем вебхук для надежности
                 bot.remove_webhook()
                 # Запускаем бота в режиме polling
                 logger.info("Запускаю бота в режиме polling...")
-                bot.infinity_polling(timeout=10, long_polling_timeout=5, allowed_updates=None)
+                # Обработчики есть только для сообщений и callback-кнопок - остальные типы
+                # обновлений Telegram не присылает вовсе
+                bot.infinity_polling(timeout=10, long_polling_timeout=5,
+                                     allowed_updates=['message', 'callback_query'])
             else:
                 logger.error("Бот уже запущен в другом процессе. Завершение работы.")
                 print("ОШИБКА: Бот уже запущен в другом процессе!")
                 print("Используйте restart_bot.py для перезапуска.")
                 sys.exit(1)
     except Exception as e:
-        logger.error(f"Критическая ошибка при запуске бота: {e}")
-        traceback.print_exc()
+        logger.exception("Критическая ошибка при запуске бота: %s", e)
    
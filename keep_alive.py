@@ -5,7 +5,9 @@ import logging
 import os
 import random
 import json
+import collections
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logger = logging.getLogger(__name__)
 
@@ -15,16 +17,25 @@ class KeepAliveService:
     def __init__(self):
         self.render_url = os.environ.get('RENDER_EXTERNAL_URL')
         self.is_running = False
+        # Моменты времени храним как datetime и форматируем только при запросе статуса
+        self._start_dt = datetime.now()
         self.stats = {
             'total_pings': 0,
             'successful_pings': 0,
             'failed_pings': 0,
             'last_successful_ping': None,
-            'start_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'errors': []
+            # Хранятся только последние 10 ошибок, старые вытесняются автоматически
+            'errors': collections.deque(maxlen=10)
         }
         self.thread = None
+        # Прерывает ожидание между пингами, чтобы stop() не ждал до 12 минут
+        self._stop_event = threading.Event()
         self.ping_urls = []
+        self._session = None
+        self._ping_pool = None
+        self._ping_prefixes = []
+        # Собственный генератор: пинги не обращаются к общему экземпляру random
+        self._rng = random.Random(os.urandom(8))
         
     def setup(self):
         """Настраивает параметры сервиса keep-alive"""
@@ -44,18 +55,24 @@ class KeepAliveService:
             # Можно добавить дополнительные пути, если они есть в вашем приложении
         ]
         
+        # Адреса с уже готовым параметром против кэширования: в пинге дописывается только число
+        self._ping_prefixes = [f"{url}?nocache=" for url in self.ping_urls]
+        
+        # Одна сессия на все пинги: TCP/TLS-соединение переиспользуется между запросами
+        if self._session is None:
+            self._session = requests.Session()
+        
         logger.info(f"Keep-alive настроен для URL: {self.render_url}")
         return self
     
-    def _do_ping(self, url):
+    def _do_ping(self, prefix):
         """Выполняет один ping-запрос и возвращает результат"""
         try:
             # Добавляем случайный параметр, чтобы избежать кэширования
-            random_param = f"?nocache={random.randint(10000, 99999)}"
-            full_url = f"{url}{random_param}"
+            full_url = prefix + str(self._rng.randint(10000, 99999))
             
             # Отправляем запрос с таймаутом
-            response = requests.get(full_url, timeout=10)
+            response = self._session.get(full_url, timeout=10)
             
             # Проверяем статус ответа
             if response.status_code == 200:
@@ -72,22 +89,37 @@ class KeepAliveService:
         """Основная функция, выполняющая периодические пинги"""
         logger.info("Keep-alive поток запущен")
         
-        while self.is_running:
+        while not self._stop_event.is_set():
+            # stop() может закрыть пул, пока поток еще не вышел из цикла
+            ping_pool = self._ping_pool
+            if ping_pool is None:
+                break
+            
+            # Пингуем все URL из списка одновременно и ждем первого успешного ответа,
+            # чтобы недоступный адрес не задерживал проверку остальных на весь таймаут
+            try:
+                futures = {
+                    ping_pool.submit(self._do_ping, prefix): url
+                    for url, prefix in zip(self.ping_urls, self._ping_prefixes)
+                }
+            except RuntimeError:
+                # Пул уже остановлен
+                break
+            
             self.stats['total_pings'] += 1
             ping_success = False
-            
-            # Пробуем все URL из списка, пока один не сработает
-            for url in self.ping_urls:
-                success, error = self._do_ping(url)
+            for future in as_completed(futures):
+                url = futures[future]
+                success, error = future.result()
                 
                 if success:
                     ping_success = True
                     self.stats['successful_pings'] += 1
-                    self.stats['last_successful_ping'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    self.stats['last_successful_ping'] = datetime.now()
                     
                     # Логируем успешные пинги, но не каждый раз
                     if self.stats['successful_pings'] % 6 == 0:  # примерно раз в час при 10-минутном интервале
-                        uptime = datetime.now() - datetime.strptime(self.stats['start_time'], '%Y-%m-%d %H:%M:%S')
+                        uptime = datetime.now() - self._start_dt
                         hours, remainder = divmod(uptime.seconds, 3600)
                         minutes, _ = divmod(remainder, 60)
                         logger.info(
@@ -95,7 +127,7 @@ class KeepAliveService:
                             f"Успешно: {self.stats['successful_pings']}/{self.stats['total_pings']} пингов."
                         )
                     
-                    # Если один из URL работает, прекращаем проверку остальных
+                    # Если один из URL работает, результаты остальных не ждем
                     break
                 else:
                     # Записываем информацию об ошибке
@@ -105,10 +137,11 @@ class KeepAliveService:
                         'error': error
                     }
                     
-                    # Ограничиваем количество сохраняемых ошибок
                     self.stats['errors'].append(error_info)
-                    if len(self.stats['errors']) > 10:
-                        self.stats['errors'] = self.stats['errors'][-10:]
+            
+            # Пинги, прерванные остановкой сервиса, ошибкой не считаем
+            if self._stop_event.is_set():
+                break
             
             # Если ни один URL не ответил, увеличиваем счетчик ошибок
             if not ping_success:
@@ -117,8 +150,9 @@ class KeepAliveService:
             
             # Рандомизированная задержка между запросами (от 8 до 12 минут)
             # Это поможет избежать паттернов, которые могут привести к засыпанию
-            sleep_time = 600 + random.randint(-120, 120)
-            time.sleep(sleep_time)
+            sleep_time = 600 + self._rng.randint(-120, 120)
+            if self._stop_event.wait(sleep_time):
+                break
     
     def start(self):
         """Запускает keep-alive сервис в отдельном потоке"""
@@ -126,11 +160,13 @@ class KeepAliveService:
             logger.warning("Keep-alive уже запущен")
             return self
         
-        # Настраиваем параметры, если еще не сделано
-        if not self.ping_urls:
+        # Настраиваем параметры, если еще не сделано или сессия закрыта в stop()
+        if not self.ping_urls or self._session is None:
             self.setup()
         
         self.is_running = True
+        self._stop_event.clear()
+        self._ping_pool = ThreadPoolExecutor(max_workers=len(self.ping_urls), thread_name_prefix='keep-alive-ping')
         self.thread = threading.Thread(target=self._keep_alive_task, daemon=True)
         self.thread.start()
         logger.info("Keep-alive сервис запущен")
@@ -139,19 +175,32 @@ class KeepAliveService:
     def stop(self):
         """Останавливает keep-alive сервис"""
         self.is_running = False
+        self._stop_event.set()
         if self.thread and self.thread.is_alive():
             # Ждем завершения потока, но не больше 5 секунд
             self.thread.join(timeout=5)
+        if self._ping_pool is not None:
+            self._ping_pool.shutdown(wait=False)
+            self._ping_pool = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
         logger.info("Keep-alive сервис остановлен")
         return self
     
     def get_status(self):
         """Возвращает текущий статус сервиса keep-alive"""
-        uptime = datetime.now() - datetime.strptime(self.stats['start_time'], '%Y-%m-%d %H:%M:%S')
+        uptime = datetime.now() - self._start_dt
+        last_ping = self.stats['last_successful_ping']
         return {
             'is_running': self.is_running,
             'uptime': str(uptime),
-            'stats': self.stats,
+            'stats': {
+                **self.stats,
+                'last_successful_ping': last_ping.strftime('%Y-%m-%d %H:%M:%S') if last_ping else None,
+                'start_time': self._start_dt.strftime('%Y-%m-%d %H:%M:%S'),
+                'errors': list(self.stats['errors'])
+            },
             'ping_urls': self.ping_urls
         }
 